@@ -0,0 +1,87 @@
+"""
+Measure bcrypt hashing time on this host and suggest a cost for a target
+latency. Run on the hardware that serves logins:
+
+    python -m auth.calibrate --target-ms 250
+"""
+import argparse
+import statistics
+import time
+
+from passlib.hash import bcrypt
+
+MIN_ROUNDS = 4
+MAX_ROUNDS = 16
+
+
+def measure(rounds: int, samples: int) -> float:
+    """
+    Get the median time in milliseconds to hash a password
+
+    Args:
+        - `rounds`: bcrypt cost
+        - `samples`: Number of hashes to time
+    """
+    handler = bcrypt.using(rounds=rounds)
+    timings = []
+
+    for _ in range(samples):
+        started = time.perf_counter()
+        handler.hash("calibration-password")
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return statistics.median(timings)
+
+
+def calibrate(target_ms: float, samples: int = 5):
+    """
+    Time each cost until hashing exceeds the target and return the highest
+    cost within it, with the timings measured
+
+    Args:
+        - `target_ms`: Target hashing time in milliseconds
+        - `samples`: Hashes timed per cost
+    """
+    suggested = MIN_ROUNDS
+    timings = {}
+
+    # The first hash loads the bcrypt backend, keep it out of the timings
+    measure(MIN_ROUNDS, 1)
+
+    for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+        timings[rounds] = measure(rounds, samples)
+
+        if timings[rounds] > target_ms:
+            break
+
+        suggested = rounds
+
+    return suggested, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--target-ms",
+        type=float,
+        default=250,
+        help="Target time to hash one password (default: 250)",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=5,
+        help="Hashes timed per cost (default: 5)",
+    )
+    args = parser.parse_args()
+
+    suggested, timings = calibrate(args.target_ms, args.samples)
+
+    for rounds, elapsed in timings.items():
+        print(f"rounds={rounds:>2}  {elapsed:8.1f} ms")
+
+    print(f"\nSuggested: BCRYPT_ROUNDS={suggested}")
+
+
+if __name__ == "__main__":
+    main()
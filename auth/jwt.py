@@ -1,12 +1,21 @@
+import time
 import jwt
 from fastapi import Depends, HTTPException, status
 
-from models.security import JWTTokenData
-from models.user import User
+import config
+import utils.metrics as metrics
+from models.security import JWTTokenData, Principal
 
 import database.user as db
 
 import auth.security
+from auth.revocation import revocations
+from utils.cache import TTLCache
+
+settings = config.get_settings()
+
+token_cache = TTLCache(maxsize=settings.JWT_CACHE_SIZE)
+"""Verified token data keyed by the raw token, expiring with the token"""
 
 
 async def authenticate_user(email: str, password: str):
@@ -18,23 +27,85 @@ async def authenticate_user(email: str, password: str):
         - `email`: The email to authenticate
         - `password`: The password to authenticate
     """
-    user = await db.get_user_by_email(email)
+    user = await db.get_user_auth(email)
 
     if not user:
         return False
 
-    if not auth.security.verify_password(password, user.hashed_password):
+    if not await auth.security.verify_password_async(
+        password, user.hashed_password
+    ):
         return False
 
+    # Migrate hashes made with an old bcrypt cost while we have the password
+    if auth.security.password_needs_rehash(user.hashed_password):
+        hashed_password = await auth.security.get_password_hash_async(password)
+        await db.update_password_hash(
+            user.id, user.hashed_password, hashed_password
+        )
+
     return user
 
 
+def decode_token(token: str):
+    """
+    Verify a JWT and return its token data, or None if the token is invalid.
+    Verified tokens are cached until they expire so repeat requests skip
+    signature verification and claim parsing
+
+    Args:
+        - `token`: OAuth2 token
+    """
+    token_data: JWTTokenData = token_cache.get(token)
+
+    if token_data is not None:
+        metrics.JWT_CACHE.labels("hit").inc()
+        return token_data
+
+    metrics.JWT_CACHE.labels("miss").inc()
+    start = time.perf_counter()
+
+    try:
+        payload = jwt.decode(
+            token,
+            auth.security.SECRET_KEY,
+            algorithms=[auth.security.ALGORITHM],
+        )
+    except jwt.PyJWTError:
+        return None
+    finally:
+        metrics.JWT_VERIFY.observe(time.perf_counter() - start)
+
+    email: str = payload.get("sub")
+
+    if email is None:
+        return None
+
+    permissions: str = payload.get("permissions")
+    token_data = JWTTokenData(
+        email=email,
+        permissions=permissions,
+        id=payload.get("uid"),
+        is_active=payload.get("active"),
+        is_admin_user=payload.get("admin"),
+        is_super_user=payload.get("super"),
+        jti=payload.get("jti"),
+        exp=payload.get("exp"),
+    )
+
+    if "exp" in payload:
+        token_cache.set(token, token_data, ttl=payload["exp"] - time.time())
+
+    return token_data
+
+
 async def get_current_user_from_token(
     token: str = Depends(auth.security.oauth2_scheme),
 ):
     """
     Get the current active user from the client's OAuth2 token. Required for
-    authenication. Returns the active user from the database
+    authenication. Returns the user's cached principal, or the verified
+    token data in claims-only mode
 
     Args:
         - `token`: OAuth2 token
@@ -45,25 +116,18 @@ async def get_current_user_from_token(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    try:
-        payload = jwt.decode(
-            token,
-            auth.security.SECRET_KEY,
-            algorithms=[auth.security.ALGORITHM],
-        )
-
-        email: str = payload.get("sub")
+    token_data = decode_token(token)
 
-        if email is None:
-            raise credentials_exception
-
-        permissions: str = payload.get("permissions")
-        token_data = JWTTokenData(email=email, permissions=permissions)
+    if token_data is None:
+        raise credentials_exception
 
-    except jwt.PyJWTError:
+    if token_data.jti and await revocations.is_revoked(token_data.jti):
         raise credentials_exception
 
-    user = await db.get_user_by_email(token_data.email)
+    if settings.CLAIMS_ONLY_AUTH and token_data.has_claims:
+        return token_data
+
+    user = await db.get_principal(token_data.email)
 
     if user is None:
         raise credentials_exception
@@ -72,7 +136,7 @@ async def get_current_user_from_token(
 
 
 async def get_active_user(
-    current_user: User = Depends(get_current_user_from_token),
+    current_user: Principal = Depends(get_current_user_from_token),
 ):
     """
     Get the current user from OAuth token and return the user
@@ -88,7 +152,7 @@ async def get_active_user(
 
 
 async def get_current_active_admin(
-    current_user: User = Depends(get_current_user_from_token),
+    current_user: Principal = Depends(get_current_user_from_token),
 ):
     """
     Get the current user from OAuth token and return the user
@@ -106,7 +170,7 @@ async def get_current_active_admin(
 
 
 async def get_current_active_superuser(
-    current_user: User = Depends(get_current_user_from_token),
+    current_user: Principal = Depends(get_current_user_from_token),
 ):
     """
     Get the current user from OAuth token and return the user
@@ -121,3 +185,53 @@ async def get_current_active_superuser(
         )
 
     return current_user
+
+
+async def get_current_active_admin_from_db(
+    current_user: Principal = Depends(get_current_active_admin),
+):
+    """
+    Get the current user from OAuth token and return the user if
+    "is_active" and "is_admin_user". For privileged writes, in claims-only
+    mode the user is read from the database so privileges removed since the
+    token was issued can't be used
+
+    Args:
+        - `current_user`: The current OAuth user
+    """
+    if not settings.CLAIMS_ONLY_AUTH:
+        return current_user
+
+    user = await db.get_user_auth(current_user.email)
+
+    if user is None or not user.is_active or not user.is_admin_user:
+        raise HTTPException(
+            status_code=403, detail="The user doesn't have enough privileges"
+        )
+
+    return user
+
+
+async def get_current_active_superuser_from_db(
+    current_user: Principal = Depends(get_current_active_superuser),
+):
+    """
+    Get the current user from OAuth token and return the user if
+    "is_active" and "is_super_user". For privileged writes, in claims-only
+    mode the user is read from the database so privileges removed since the
+    token was issued can't be used
+
+    Args:
+        - `current_user`: The current OAuth user
+    """
+    if not settings.CLAIMS_ONLY_AUTH:
+        return current_user
+
+    user = await db.get_user_auth(current_user.email)
+
+    if user is None or not user.is_active or not user.is_super_user:
+        raise HTTPException(
+            status_code=403, detail="The user doesn't have enough privileges"
+        )
+
+    return user
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+
+import database.token as db
+from utils.bloom import BloomFilter
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class RevocationList:
+    """
+    Revoked token IDs held in an in-memory Bloom filter. A token not in the
+    filter is certainly not revoked, so only possible hits are confirmed
+    against the database
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        """
+        Args:
+            - `capacity`: Minimum number of IDs the filter is sized for
+            - `error_rate`: Target false positive rate
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        self.filter = BloomFilter(capacity, error_rate)
+        """The revoked token IDs"""
+
+        self.task: asyncio.Task = None
+        """The periodic refresh task"""
+
+        self._added: list = None
+
+    def add(self, jti: str):
+        """
+        Add a revoked token ID to this worker's filter
+
+        Args:
+            - `jti`: The token's unique ID
+        """
+        self.filter.add(jti)
+
+        if self._added is not None:
+            self._added.append(jti)
+
+    async def is_revoked(self, jti: str) -> bool:
+        """
+        Check if a token is revoked
+
+        Args:
+            - `jti`: The token's unique ID
+        """
+        if jti not in self.filter:
+            return False
+
+        return await db.is_token_revoked(jti)
+
+    async def refresh(self):
+        """Rebuild the filter from the revoked tokens in the database"""
+
+        # IDs revoked by this worker while loading are carried over
+        self._added = added = []
+
+        try:
+            ids = [jti async for jti in db.get_revoked_token_ids()]
+        finally:
+            self._added = None
+
+        revoked = BloomFilter(
+            max(self.capacity, 2 * len(ids)), self.error_rate
+        )
+
+        for jti in ids + added:
+            revoked.add(jti)
+
+        self.filter = revoked
+
+    async def _run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh revoked tokens")
+
+    def start(self, interval: float):
+        """
+        Refresh the filter in the background, starting after `interval`.
+        Call `refresh` first, until then no token is seen as revoked
+
+        Args:
+            - `interval`: Seconds between refreshes
+        """
+        self.task = asyncio.create_task(self._run(interval))
+
+    def stop(self):
+        """Stop refreshing the filter"""
+
+        if self.task is not None:
+            self.task.cancel()
+
+        self.task = None
+
+
+revocations = RevocationList()
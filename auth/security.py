@@ -1,18 +1,165 @@
+import asyncio
+import multiprocessing
+import os
+import time
+import uuid
 import jwt
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from typing import List
 
+from fastapi import HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 
+import config
+import utils.metrics as metrics
+from utils.list import chunker
+
+settings = config.get_settings()
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+)
 
 SECRET_KEY = "guiyfgc837tgf3iw87-012389764"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
 
+class HashQueueFull(HTTPException):
+    """Raised when too much password hashing work is already in flight"""
+
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again",
+            headers={"Retry-After": "1"},
+        )
+
+
+def timed(fn, *args):
+    """
+    Run a function, returning its result with when it started (wall clock,
+    comparable across processes) and how long it took
+
+    Args:
+        - `fn`: The function to run
+        - `args`: Arguments for `fn`
+    """
+    started = time.time()
+    result = fn(*args)
+
+    return result, started, time.time() - started
+
+
+class HashManager:
+    """Runs password hashing in a bounded process pool"""
+
+    pool: ProcessPoolExecutor = None
+    """The process pool running bcrypt work"""
+
+    workers: int = 1
+    """Number of hashing processes"""
+
+    capacity: int = None
+    """Maximum number of hashing jobs running or queued at once"""
+
+    pending: int = 0
+    """Number of hashing jobs currently running or queued"""
+
+    bulk_jobs: asyncio.Semaphore = None
+    """Limits the bulk hashing jobs in the pool, across every bulk caller"""
+
+    def start(self, workers: int, max_queue: int, bulk_jobs: int = None):
+        """
+        Start the hashing process pool. Until this is called hashing runs
+        on the event loop's default thread executor
+
+        Args:
+            - `workers`: Number of hashing processes
+            - `max_queue`: Number of jobs allowed to wait for a free process
+            - `bulk_jobs`: Most bulk hashing jobs in the pool at once
+              (default: one less than `workers`, at least 1)
+        """
+        # Spawn rather than fork, the event loop and Motor's threads must not
+        # be copied into the hashing processes
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self.workers = workers
+        self.capacity = workers + max_queue
+        self.bulk_jobs = asyncio.Semaphore(bulk_jobs or max(1, workers - 1))
+
+    async def warm(self):
+        """
+        Start every hashing process now, rather than making the first logins
+        wait for processes to start and import the app
+        """
+        if self.pool is None:
+            return
+
+        loop = asyncio.get_running_loop()
+
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(self.pool, os.getpid)
+                for _ in range(self.workers)
+            )
+        )
+
+    def close(self):
+        """Shut down the hashing process pool"""
+
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+        self.pool = None
+        self.workers = 1
+        self.capacity = None
+        self.bulk_jobs = None
+
+    async def run(self, fn, *args):
+        """
+        Run a hashing function off the event loop
+
+        Args:
+            - `fn`: Module level function to run (must be picklable)
+            - `args`: Arguments for `fn`
+        """
+        if self.capacity is not None and self.pending >= self.capacity:
+            metrics.HASH_REJECTED.inc()
+            raise HashQueueFull()
+
+        self.pending += 1
+
+        try:
+            loop = asyncio.get_running_loop()
+            queued = time.time()
+
+            result, started, duration = await loop.run_in_executor(
+                self.pool, timed, fn, *args
+            )
+        finally:
+            self.pending -= 1
+
+        operation = fn.__name__
+        metrics.HASH_QUEUE_WAIT.labels(operation).observe(
+            max(0.0, started - queued)
+        )
+        metrics.HASH_DURATION.labels(operation).observe(duration)
+
+        return result
+
+
+hasher = HashManager()
+
+
 def get_password_hash(password: str) -> str:
     """
     Convert a password to an ineligible hash to store in the database
@@ -34,6 +181,80 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    """
+    Check if a hash was made with outdated settings, such as another bcrypt
+    cost, and should be replaced. Unrecognised hashes are left alone
+
+    Args:
+        `hashed_password`: Hashed password
+    """
+    if pwd_context.identify(hashed_password) is None:
+        return False
+
+    return pwd_context.needs_update(hashed_password)
+
+
+def get_password_hashes(passwords: List[str]) -> List[str]:
+    """
+    Hash a batch of passwords
+
+    Args:
+        `passwords`: The passwords to hash
+    """
+    return [get_password_hash(password) for password in passwords]
+
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    Hash a password in the hashing pool without blocking the event loop
+
+    Args:
+        `password`: The password to hash
+    """
+    return await hasher.run(get_password_hash, password)
+
+
+async def get_password_hashes_async(passwords: List[str]) -> List[str]:
+    """
+    Hash many passwords in small jobs. Once the pool is started at most
+    `HASH_BULK_JOBS` bulk jobs are in it at once, however many imports are
+    running, so a login waits for one small job at most
+
+    Args:
+        `passwords`: The passwords to hash
+    """
+
+    async def hash_batch(batch: List[str]):
+        if hasher.bulk_jobs is None:
+            return await hasher.run(get_password_hashes, batch)
+
+        async with hasher.bulk_jobs:
+            return await hasher.run(get_password_hashes, batch)
+
+    batches = await asyncio.gather(
+        *(
+            hash_batch(batch)
+            for batch in chunker(passwords, settings.HASH_BULK_JOB_SIZE)
+        )
+    )
+
+    return [hashed for batch in batches for hashed in batch]
+
+
+async def verify_password_async(
+    plain_password: str, hashed_password: str
+) -> bool:
+    """
+    Verify a password in the hashing pool without blocking the event loop
+
+    Args:
+        `plain_password`: Unhashed password
+        `hashed_password`: Hashed password
+    """
+    return await hasher.run(verify_password, plain_password, hashed_password)
+
+
 def create_access_token(*, data: dict, expires_delta: timedelta = None):
     """
     Create an access token for the front end client
@@ -50,6 +271,7 @@ def create_access_token(*, data: dict, expires_delta: timedelta = None):
         expire = datetime.utcnow() + timedelta(minutes=15)
 
     to_encode.update({"exp": expire})
+    to_encode.setdefault("jti", uuid.uuid4().hex)
 
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
@@ -0,0 +1,128 @@
+import math
+import time
+
+from fastapi import HTTPException, Request, status
+
+import config
+from utils.cache import TTLCache
+
+settings = config.get_settings()
+
+
+class TokenBucketLimiter:
+    """
+    In-memory token buckets, one per key. Buckets are kept in a size
+    bounded LRU cache and dropped once they would be full again, so memory
+    stays bounded however many keys are seen
+    """
+
+    def __init__(self, capacity: int, per_minute: float, maxsize: int):
+        """
+        Args:
+            - `capacity`: Requests allowed in a burst
+            - `per_minute`: Requests allowed per minute once the burst is used
+            - `maxsize`: Maximum number of buckets kept
+        """
+        if capacity < 1 or per_minute <= 0:
+            raise ValueError(
+                "A limiter needs a capacity of at least 1 and a positive rate"
+            )
+
+        self.capacity = capacity
+        self.rate = per_minute / 60
+
+        self.buckets = TTLCache(maxsize=maxsize, ttl=capacity / self.rate)
+        """(tokens, last update) keyed by the limited key"""
+
+    def acquire(self, key: str) -> float:
+        """
+        Take a token from a key's bucket. Returns 0 if allowed, or the
+        seconds until a token is available if the bucket is empty
+
+        Args:
+            - `key`: The key to limit (an IP address, an account)
+        """
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+
+        if tokens < 1:
+            self.buckets.set(key, (tokens, now))
+
+            return (1 - tokens) / self.rate
+
+        self.buckets.set(key, (tokens - 1, now))
+
+        return 0
+
+    def clear(self):
+        """Forget every bucket"""
+
+        self.buckets.clear()
+
+
+ip_limiter = TokenBucketLimiter(
+    settings.LOGIN_IP_BURST,
+    settings.LOGIN_IP_PER_MINUTE,
+    settings.LOGIN_THROTTLE_KEYS,
+)
+"""Limits login and signup attempts per client IP"""
+
+account_limiter = TokenBucketLimiter(
+    settings.LOGIN_ACCOUNT_BURST,
+    settings.LOGIN_ACCOUNT_PER_MINUTE,
+    settings.LOGIN_THROTTLE_KEYS,
+)
+"""Limits login attempts per account"""
+
+
+def throttle(*waits: float):
+    """
+    Reject the request with a 429 if any limiter asked the client to wait
+
+    Args:
+        - `waits`: Results of `TokenBucketLimiter.acquire`
+    """
+    wait = max(waits)
+
+    if wait > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, please try again later",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+
+def client_ip(request: Request) -> str:
+    """
+    The client IP address a request is throttled by. Requests without one
+    (e.g. over a Unix socket) share a single bucket
+
+    Args:
+        - `request`: The request
+    """
+    return request.client.host if request.client else "unknown"
+
+
+def check_login(ip: str, username: str):
+    """
+    Throttle a login attempt by client IP and by account, before any
+    database lookup or password hashing. An attempt rejected by IP doesn't
+    use up the account's attempts, so one client can't lock an account out
+
+    Args:
+        - `ip`: The client's IP address
+        - `username`: The account being logged in to
+    """
+    throttle(ip_limiter.acquire(ip))
+    throttle(account_limiter.acquire(username.strip().lower()))
+
+
+def check_signup(ip: str):
+    """
+    Throttle a signup attempt by client IP
+
+    Args:
+        - `ip`: The client's IP address
+    """
+    throttle(ip_limiter.acquire(ip))
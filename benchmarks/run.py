@@ -0,0 +1,296 @@
+"""
+Time the auth and data hot paths offline and compare them with a stored
+baseline:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --save-baseline
+
+Exits with status 1 if any benchmark is slower than the baseline by more
+than the tolerance.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import timeit
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple
+
+from pydantic import validate_model
+
+import auth.jwt
+import auth.security as security
+import benchmarks.serialization as serialization
+import database.backend as backend
+import database.user as db
+from models.user import User, UserOut
+from utils.list import chunker
+from utils.response import FastJSONResponse
+
+BENCHMARKS_PATH = Path(__file__).resolve().parent
+
+BASELINE_PATH = BENCHMARKS_PATH / "baseline.json"
+"""Results to compare against, see --save-baseline"""
+
+RESULTS_PATH = BENCHMARKS_PATH / "results.json"
+"""Results of the latest run"""
+
+
+class Case(NamedTuple):
+    """A function to time"""
+
+    name: str
+    fn: Callable[[], object]
+    number: int
+    """Calls per timing repeat"""
+
+
+def auth_cases() -> List[Case]:
+    """Token creation and verification, password hashing"""
+
+    token = security.create_access_token(
+        data={"sub": "user@email.com", "permissions": "user"},
+        expires_delta=timedelta(minutes=15),
+    )
+    hashed_password = security.get_password_hash("password")
+
+    def decode_uncached():
+        auth.jwt.token_cache.clear()
+        auth.jwt.decode_token(token)
+
+    return [
+        Case(
+            "create_access_token",
+            lambda: security.create_access_token(
+                data={"sub": "user@email.com", "permissions": "user"},
+                expires_delta=timedelta(minutes=15),
+            ),
+            2000,
+        ),
+        Case("decode_token[uncached]", decode_uncached, 2000),
+        Case(
+            "decode_token[cached]", lambda: auth.jwt.decode_token(token), 2000
+        ),
+        Case(
+            "get_password_hash",
+            lambda: security.get_password_hash("password"),
+            3,
+        ),
+        Case(
+            "verify_password",
+            lambda: security.verify_password("password", hashed_password),
+            3,
+        ),
+    ]
+
+
+def model_cases() -> List[Case]:
+    """User document and response construction and serialization"""
+
+    document = serialization.make_documents(1)[0]
+    fields = {**document, "hashed_password": "hash"}
+    user_out = UserOut.parse_obj(document)
+
+    return [
+        # Documents can't be created without a database, time the
+        # validation they run on construction instead
+        Case("User[validate]", lambda: validate_model(User, fields), 2000),
+        Case("UserOut.parse_obj", lambda: UserOut.parse_obj(document), 2000),
+        Case(
+            "UserOut.construct",
+            lambda: UserOut.construct(**document),
+            2000,
+        ),
+        Case("UserOut.json", lambda: user_out.json(by_alias=True), 2000),
+        Case("FastJSONResponse", lambda: FastJSONResponse(user_out), 2000),
+    ]
+
+
+def serialization_cases(sizes: List[int]) -> List[Case]:
+    """User list responses, as benchmarks.serialization"""
+
+    loop = asyncio.new_event_loop()
+    cases = []
+
+    for size in sizes:
+        documents = serialization.make_documents(size)
+
+        for path in serialization.PATHS:
+            cases.append(
+                Case(
+                    f"user_list.{path.__name__}[n={size}]",
+                    lambda path=path, documents=documents: path(
+                        documents, loop
+                    ),
+                    max(1, 1000 // size),
+                )
+            )
+
+    return cases
+
+
+def database_cases(sizes: List[int]) -> List[Case]:
+    """User reads through `database.user` on the in-memory backend"""
+
+    loop = asyncio.new_event_loop()
+    cases = []
+
+    for size in sizes:
+        backend.use("memory")
+        users = backend.users
+        # New documents get their own `_id`
+        documents = [
+            db.new_user_document(
+                hashed_password="hash",
+                **{k: v for k, v in document.items() if k != "_id"},
+            )
+            for document in serialization.make_documents(size)
+        ]
+        loop.run_until_complete(users.insert_many(documents))
+        email = documents[size // 2]["email"]
+
+        def get_principal(users=users, email=email):
+            backend.users = users
+            db.forget_principals()
+            loop.run_until_complete(db.get_principal(email))
+
+        def get_users(users=users):
+            backend.users = users
+            loop.run_until_complete(db.get_users(100, sort="email"))
+
+        cases += [
+            Case(f"get_principal[n={size}]", get_principal, 2000),
+            Case(f"get_users[n={size}]", get_users, max(1, 10000 // size)),
+        ]
+
+    return cases
+
+
+def chunker_cases(sizes: List[int]) -> List[Case]:
+    """Chunking lists of each size into chunks of 100"""
+
+    cases = []
+
+    for size in sizes:
+        items = list(range(size))
+
+        cases.append(
+            Case(
+                f"chunker[n={size}]",
+                lambda items=items: list(chunker(items, 100)),
+                max(1, 100000 // size),
+            )
+        )
+
+    return cases
+
+
+def run(cases: List[Case], repeat: int) -> Dict[str, float]:
+    """
+    Time every case, keeping the best of `repeat` timings
+
+    Args:
+        - `cases`: The cases to time
+        - `repeat`: Timings per case
+    """
+    results = {}
+
+    for case in cases:
+        timer = timeit.Timer(case.fn)
+        best = min(timer.repeat(repeat=repeat, number=case.number))
+        results[case.name] = best / case.number
+
+        print(f"{case.name:<40} {results[case.name] * 1e6:12.2f} us")
+
+    return results
+
+
+def compare(
+    results: Dict[str, float], baseline: Dict[str, float], tolerance: float
+) -> List[str]:
+    """
+    List the benchmarks slower than their baseline by more than the
+    tolerance
+
+    Args:
+        - `results`: Seconds per call by benchmark
+        - `baseline`: Baseline seconds per call by benchmark
+        - `tolerance`: Allowed slowdown, 0.25 is 25% slower
+    """
+    regressions = []
+
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+
+        change = seconds / baseline[name] - 1
+
+        if change > tolerance:
+            regressions.append(f"{name}: {change:+.0%} vs baseline")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--output", type=Path, default=RESULTS_PATH)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store this run's results as the baseline",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000],
+        help="Input sizes for list benchmarks",
+    )
+    args = parser.parse_args()
+
+    cases = (
+        auth_cases()
+        + model_cases()
+        + serialization_cases(args.sizes)
+        + database_cases(args.sizes)
+        + chunker_cases([size * 100 for size in args.sizes])
+    )
+    results = run(cases, args.repeat)
+
+    report = {
+        "created": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "bcrypt_rounds": security.settings.BCRYPT_ROUNDS,
+        "results": results,
+    }
+
+    args.output.write_text(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline")
+        return
+
+    baseline = json.loads(args.baseline.read_text())
+    regressions = compare(results, baseline["results"], args.tolerance)
+
+    if regressions:
+        print("\nRegressions:")
+        print("\n".join(regressions))
+        sys.exit(1)
+
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
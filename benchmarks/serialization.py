@@ -0,0 +1,105 @@
+"""
+Compare ways of serializing a list of user responses, without a database:
+
+    python -m benchmarks.serialization --users 100
+"""
+import argparse
+import asyncio
+import timeit
+from typing import List
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from models.user import UserOut
+from utils.response import FastJSONResponse
+
+response_field = create_response_field(
+    name="Response_user_list", type_=List[UserOut]
+)
+
+
+def make_documents(count: int):
+    """
+    Make user documents as Motor returns them, projected to `UserOut`
+
+    Args:
+        - `count`: Number of documents
+    """
+    return [
+        {
+            "_id": ObjectId(),
+            "email": f"user{index}@email.com",
+            "first_name": "First",
+            "last_name": "Last",
+            "avatar": f"https://avatars.example.com/{index}.png",
+            "is_active": True,
+            "is_admin_user": False,
+            "is_super_user": False,
+        }
+        for index in range(count)
+    ]
+
+
+def validated(documents, loop: asyncio.AbstractEventLoop) -> bytes:
+    """Validate on read and against the response model, encode with json"""
+
+    users = [UserOut.parse_obj(document) for document in documents]
+    content = loop.run_until_complete(
+        serialize_response(field=response_field, response_content=users)
+    )
+
+    return JSONResponse(content).body
+
+
+def constructed(documents, loop: asyncio.AbstractEventLoop) -> bytes:
+    """Construct on read, validate against the response model"""
+
+    users = [UserOut.construct(**document) for document in documents]
+    content = loop.run_until_complete(
+        serialize_response(field=response_field, response_content=users)
+    )
+
+    return JSONResponse(content).body
+
+
+def fast(documents, loop: asyncio.AbstractEventLoop) -> bytes:
+    """Construct on read, encode with orjson (FAST_RESPONSES)"""
+
+    users = [UserOut.construct(**document) for document in documents]
+
+    return FastJSONResponse(users).body
+
+
+PATHS = [validated, constructed, fast]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    documents = make_documents(args.users)
+    loop = asyncio.new_event_loop()
+    timings = {}
+
+    for path in PATHS:
+        timer = timeit.Timer(lambda: path(documents, loop))
+        timings[path.__name__] = min(
+            timer.repeat(repeat=5, number=args.repeat)
+        )
+
+    baseline = timings[PATHS[0].__name__]
+
+    for name, elapsed in timings.items():
+        per_call = elapsed / args.repeat * 1000
+        print(f"{name:<12} {per_call:8.3f} ms  {baseline / elapsed:5.1f}x")
+
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -24,17 +24,123 @@ class Settings(BaseSettings):
     """MongoDB database name"""
     DB_NAME_DEV: str = os.getenv("DB_NAME_DEV")
     """MongoDB database name"""
+    DB_MAX_POOL_SIZE: int = 10
+    """Connections per worker to each MongoDB server"""
+    DB_MIN_POOL_SIZE: int = 10
+    """Connections per worker kept open, opened before serving requests"""
+    DB_MAX_CONNECTING: int = 2
+    """Connections a pool opens at once"""
+    DB_WARM_TIMEOUT_MS: int = 10000
+    """Longest wait for DB_MIN_POOL_SIZE connections before serving requests"""
+    DB_MAX_IDLE_TIME_MS: int = None
+    """Idle connections above the minimum are closed after this long"""
+    DB_WAIT_QUEUE_TIMEOUT_MS: int = None
+    """Longest wait for a free connection before failing"""
+    DB_CONNECT_TIMEOUT_MS: int = 20000
+    """Longest wait to open a connection"""
+    DB_SERVER_SELECTION_TIMEOUT_MS: int = 30000
+    """Longest wait to find a server for an operation"""
+    DB_READ_PREFERENCE: str = "primary"
+    """
+    Where user reads go: primary, primaryPreferred, secondary,
+    secondaryPreferred or nearest. Logins always read from the primary
+    """
+    DB_MAX_STALENESS_SECONDS: int = -1
+    """Most a replica can lag and still be read from (-1 no limit, or 90+)"""
+    DB_BACKEND: str = "mongo"
+    """Storage of users and revoked tokens: mongo, or memory (not persisted)"""
 
     AWS_KEY: str = os.getenv("AWS_KEY")
     """AWS connection key"""
     AWS_SECRET: str = os.getenv("AWS_SECRET")
     """AWS connection secret key"""
+    AWS_ENDPOINT_URL: str = None
+    """S3 compatible endpoint to use instead of AWS (e.g. MinIO, moto)"""
+    S3_DOWNLOAD_CONCURRENCY: int = 16
+    """Most files downloaded from S3 at once"""
+    S3_DOWNLOAD_RETRIES: int = 3
+    """Times a failed S3 download is retried"""
+    S3_DOWNLOAD_BACKOFF: float = 0.5
+    """Seconds before the first retry of an S3 download, doubled each time"""
 
     secret_key: str = os.getenv("secret_key")
     """JWT secret key"""
     algorithm: str = "HS256"
     """JWT algorithm"""
 
+    BCRYPT_ROUNDS: int = 12
+    """bcrypt cost (see auth/calibrate.py), old hashes are rehashed on login"""
+    HASH_WORKERS: int = 2
+    """Number of processes hashing and verifying passwords"""
+    HASH_QUEUE_SIZE: int = 64
+    """Hashing jobs allowed to wait for a free process before rejecting"""
+    HASH_BULK_JOB_SIZE: int = 1
+    """Passwords per hashing job when hashing in bulk (imports)"""
+    HASH_BULK_JOBS: int = None
+    """
+    Most bulk hashing jobs in the pool at once, so logins don't queue behind
+    an import (default: one less than HASH_WORKERS, at least 1)
+    """
+
+    LOGIN_IP_BURST: int = 20
+    """Login and signup attempts a client IP can make in a burst"""
+    LOGIN_IP_PER_MINUTE: float = 20
+    """Login and signup attempts per minute per client IP after a burst"""
+    LOGIN_ACCOUNT_BURST: int = 5
+    """Login attempts an account can receive in a burst"""
+    LOGIN_ACCOUNT_PER_MINUTE: float = 5
+    """Login attempts per minute per account after a burst"""
+    LOGIN_THROTTLE_KEYS: int = 100000
+    """Client IPs and accounts tracked by each login limiter"""
+
+    JWT_CACHE_SIZE: int = 10000
+    """Verified access tokens cached per worker (0 disables the cache)"""
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    """Authenticated users cached per worker (0 disables the cache)"""
+    PRINCIPAL_CACHE_TTL: int = 5
+    """
+    Seconds a cached user is trusted before it is read again. Edits and
+    deletes clear the worker's own cache, other workers see them within this
+    """
+
+    CLAIMS_ONLY_AUTH: bool = False
+    """Authorize reads from token claims alone, without a user lookup"""
+    CLAIMS_TOKEN_EXPIRE_MINUTES: int = 5
+    """Access token lifetime in claims-only mode"""
+
+    REVOCATION_REFRESH_SECONDS: int = 30
+    """Seconds between reloads of the revoked token filter"""
+
+    FAST_RESPONSES: bool = False
+    """Serialize user responses with orjson, skipping response validation"""
+
+    USERS_PAGE_SIZE_MAX: int = 1000
+    """Largest page of users that can be requested"""
+    USERS_COUNT_TTL: int = 30
+    """Seconds the estimated number of users is cached"""
+    EXPORT_BATCH_SIZE: int = 1000
+    """Users fetched per database round trip when exporting"""
+    IMPORT_BATCH_SIZE: int = 1000
+    """Users hashed and inserted together when importing"""
+    IMPORT_MAX_BODY_BYTES: int = 10 * 1024 * 1024
+    """Largest JSON array import, NDJSON imports are streamed and unlimited"""
+    IMPORT_MAX_LINE_BYTES: int = 64 * 1024
+    """Largest record in an NDJSON import, longer lines are rejected"""
+    BULK_ID_BATCH_SIZE: int = 1000
+    """IDs per write in bulk operations on a list of users"""
+
+    METRICS_TOKEN: str = None
+    """Bearer token required to read /metrics (open when not set)"""
+    SLOW_QUERY_MS: float = 100
+    """MongoDB commands taking at least this long are logged"""
+
+    PROFILE_DIR: str = "/tmp/profiles"
+    """Where request profiles are stored, shared by every worker"""
+    PROFILE_KEEP: int = 100
+    """Number of newest request profiles kept"""
+    PROFILE_SAMPLE_MS: float = 1
+    """Stack sampling interval of collapsed stack profiles"""
+
     class Config:
         env_file = ".env"
         orm_mode = True
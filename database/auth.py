@@ -1,26 +1,30 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 from fastapi import HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from pymongo.errors import DuplicateKeyError
 
+import config
 import auth.jwt as jwt
 import auth.security as security
+from auth.revocation import revocations
 
 import models.user as models
+import database.token as token_db
 import database.user as db
 
+settings = config.get_settings()
 
-async def login_user(form_data: OAuth2PasswordRequestForm):
-    user: models.User = await jwt.authenticate_user(
-        form_data.username, form_data.password
-    )
 
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect username or password",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+def create_user_token(user: models.User):
+    """
+    Create a client access token containing the user's permissions. In
+    claims-only mode the token also carries the user's id, active and role
+    flags and a short lifetime so requests can be authorized from the token
+    alone
 
+    Args:
+        - `user`: The user to create a token for
+    """
     if user.is_super_user:
         permissions = "super"
     elif user.is_admin_user:
@@ -28,55 +32,98 @@ async def login_user(form_data: OAuth2PasswordRequestForm):
     else:
         permissions = "user"
 
-    access_token_expires = timedelta(
-        minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES
-    )
+    data = {"sub": user.email, "permissions": permissions}
+
+    if settings.CLAIMS_ONLY_AUTH:
+        data.update(
+            {
+                "uid": str(user.id),
+                "active": user.is_active,
+                "admin": user.is_admin_user,
+                "super": user.is_super_user,
+            }
+        )
+        access_token_expires = timedelta(
+            minutes=settings.CLAIMS_TOKEN_EXPIRE_MINUTES
+        )
+    else:
+        access_token_expires = timedelta(
+            minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES
+        )
 
     access_token = security.create_access_token(
-        data={
-            "sub": user.email,
-            "permissions": permissions,
-        },
-        expires_delta=access_token_expires,
+        data=data, expires_delta=access_token_expires
     )
 
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-async def signup_user(form_data: OAuth2PasswordRequestForm):
-    user = await db.get_user_by_email(form_data.username)
+async def login_user(form_data: OAuth2PasswordRequestForm):
+    user: models.UserAuthView = await jwt.authenticate_user(
+        form_data.username, form_data.password
+    )
 
-    if user:
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    return create_user_token(user)
+
+
+async def signup_user(form_data: OAuth2PasswordRequestForm):
+    try:
+        new_user = await db.insert_user(
+            models.UserCreate(
+                email=form_data.username,
+                password=form_data.password,
+                is_active=True,
+                is_super_user=True,
+                is_admin=True,
+            ),
+        )
+    except DuplicateKeyError:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Account already exists",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    new_user = await db.create_user(
-        models.UserCreate(
-            email=form_data.username,
-            password=form_data.password,
-            is_active=True,
-            is_super_user=True,
-            is_admin=True,
-        ),
-    )
+    return create_user_token(new_user)
 
-    access_token_expires = timedelta(
-        minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES
-    )
 
-    if new_user.is_super_user:
-        permissions = "super"
-    elif new_user.is_admin_user:
-        permissions = "admin"
-    else:
-        permissions = "user"
+async def logout_user(token: str):
+    token_data = jwt.decode_token(token)
 
-    access_token = security.create_access_token(
-        data={"sub": new_user.email, "permissions": permissions},
-        expires_delta=access_token_expires,
+    if token_data is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if token_data.jti is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Token can't be revoked",
+        )
+
+    await token_db.revoke_token(token_data.jti, token_data.exp)
+    revocations.add(token_data.jti)
+
+    return True
+
+
+async def revoke_token(jti: str):
+    # The token's expiry is unknown, keep the record for the longest
+    # lifetime a token can have
+    expires_at = datetime.utcnow() + timedelta(
+        minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES
     )
 
-    return {"access_token": access_token, "token_type": "bearer"}
+    await token_db.revoke_token(jti, expires_at)
+    revocations.add(jti)
+
+    return True
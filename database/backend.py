@@ -0,0 +1,33 @@
+from database.memory import MemoryRevokedTokenRepository, MemoryUserRepository
+from database.mongo import MongoRevokedTokenRepository, MongoUserRepository
+from database.repository import RevokedTokenRepository, UserRepository
+
+BACKENDS = {
+    "mongo": (MongoUserRepository, MongoRevokedTokenRepository),
+    "memory": (MemoryUserRepository, MemoryRevokedTokenRepository),
+}
+"""Repository classes for users and revoked tokens by backend name"""
+
+users: UserRepository = MongoUserRepository()
+"""The active user repository"""
+
+revoked_tokens: RevokedTokenRepository = MongoRevokedTokenRepository()
+"""The active revoked token repository"""
+
+
+def use(name: str):
+    """
+    Switch every repository to a backend. An in-memory backend starts empty
+
+    Args:
+        - `name`: `mongo` or `memory`
+    """
+    global users, revoked_tokens
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown database backend '{name}'")
+
+    user_repository, revoked_token_repository = BACKENDS[name]
+
+    users = user_repository()
+    revoked_tokens = revoked_token_repository()
@@ -0,0 +1,283 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+from beanie import PydanticObjectId
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from database.repository import (
+    Document,
+    Fields,
+    RevokedTokenRepository,
+    Selection,
+    UserRepository,
+)
+
+
+def project(document: Document, fields: Fields) -> Document:
+    """
+    Copy a document keeping only some fields, like a MongoDB projection
+
+    Args:
+        - `document`: The stored document
+        - `fields`: Fields to keep, None for all
+    """
+    if fields is None:
+        return dict(document)
+
+    projected = {"_id": document["_id"]}
+
+    for field in fields:
+        if field in document:
+            projected[field] = document[field]
+
+    return projected
+
+
+def duplicate_key_error(collection: str, field: str, value: Any):
+    """
+    Make the error MongoDB raises when a unique index is violated
+
+    Args:
+        - `collection`: The collection written to
+        - `field`: The uniquely indexed field
+        - `value`: The duplicate value
+    """
+    return DuplicateKeyError(
+        f"E11000 duplicate key error collection: {collection} "
+        f"index: {field}_1 dup key: {{ {field}: {value!r} }}",
+        11000,
+    )
+
+
+class MemoryUserRepository(UserRepository):
+    """
+    Users stored in this process's memory with a hash index on email that
+    enforces uniqueness like the MongoDB index. Nothing is persisted, use it
+    for tests, load tests and local benchmarking
+    """
+
+    def __init__(self):
+        self.documents: Dict[PydanticObjectId, Document] = {}
+        """Users by id"""
+
+        self.emails: Dict[str, PydanticObjectId] = {}
+        """Index of user ids by email"""
+
+    async def find_by_id(
+        self,
+        id: PydanticObjectId,
+        fields: Fields = None,
+        primary: bool = False,
+    ):
+        document = self.documents.get(id)
+
+        return None if document is None else project(document, fields)
+
+    async def find_by_email(
+        self, email: str, fields: Fields = None, primary: bool = False
+    ):
+        id = self.emails.get(email)
+
+        return None if id is None else project(self.documents[id], fields)
+
+    async def insert(self, document: Document):
+        id = document["_id"]
+
+        if id in self.documents:
+            raise duplicate_key_error("users", "_id", id)
+
+        if document["email"] in self.emails:
+            raise duplicate_key_error("users", "email", document["email"])
+
+        self.documents[id] = dict(document)
+        self.emails[document["email"]] = id
+
+    async def insert_many(self, documents: List[Document]):
+        errors: Dict[int, Dict[str, Any]] = {}
+
+        for index, document in enumerate(documents):
+            try:
+                await self.insert(document)
+            except DuplicateKeyError as error:
+                errors[index] = {"code": error.code, "errmsg": str(error)}
+
+        return errors
+
+    async def update(
+        self,
+        id: PydanticObjectId,
+        changes: Dict[str, Any],
+        fields: Fields = None,
+        expected: Dict[str, Any] = None,
+    ):
+        document = self.documents.get(id)
+
+        if document is None:
+            return None
+
+        for field, value in (expected or {}).items():
+            if document.get(field) != value:
+                return None
+
+        email = changes.get("email", document["email"])
+
+        if email != document["email"]:
+            if email in self.emails:
+                raise duplicate_key_error("users", "email", email)
+
+            del self.emails[document["email"]]
+            self.emails[email] = id
+
+        document.update(changes)
+
+        return project(document, fields)
+
+    async def delete(self, id: PydanticObjectId):
+        document = self.documents.pop(id, None)
+
+        if document is None:
+            return False
+
+        del self.emails[document["email"]]
+
+        return True
+
+    async def find_page(
+        self,
+        sort: str,
+        direction: int,
+        limit: int,
+        fields: Fields = None,
+        bound: Tuple[str, Any] = None,
+    ):
+        documents = self.documents.values()
+
+        if bound is not None:
+            operator, value = bound
+
+            if operator == "$gt":
+                documents = [d for d in documents if d[sort] > value]
+            else:
+                documents = [d for d in documents if d[sort] < value]
+
+        documents = sorted(
+            documents,
+            key=lambda document: document[sort],
+            reverse=direction != ASCENDING,
+        )
+
+        return [project(document, fields) for document in documents[:limit]]
+
+    async def count(self):
+        return len(self.documents)
+
+    async def iterate(self, fields: Fields = None, batch_size: int = 1000):
+        # Copy the ids so users can be changed while iterating
+        for id in list(self.documents):
+            document = self.documents.get(id)
+
+            if document is not None:
+                yield project(document, fields)
+
+    def select(self, selection: Selection) -> List[Document]:
+        """
+        Get the users in a selection
+
+        Args:
+            - `selection`: The users to get
+        """
+        selection.check()
+
+        if selection.ids:
+            documents = [
+                self.documents[id]
+                for id in dict.fromkeys(selection.ids)
+                if id in self.documents
+            ]
+        else:
+            documents = list(self.documents.values())
+
+        if selection.exclude_id is not None:
+            documents = [
+                document
+                for document in documents
+                if document["_id"] != selection.exclude_id
+            ]
+
+        if selection.email_domain:
+            suffix = f"@{selection.email_domain}".lower()
+            documents = [
+                document
+                for document in documents
+                if document["email"].lower().endswith(suffix)
+            ]
+
+        return documents
+
+    async def update_many(
+        self,
+        selection: Selection,
+        changes: Dict[str, Any],
+        batch_size: int = 1000,
+    ):
+        matched = modified = 0
+
+        for document in self.select(selection):
+            matched += 1
+
+            if any(document.get(k) != v for k, v in changes.items()):
+                await self.update(document["_id"], changes)
+                modified += 1
+
+        return matched, modified
+
+    async def delete_many(self, selection: Selection, batch_size: int = 1000):
+        documents = self.select(selection)
+
+        for document in documents:
+            await self.delete(document["_id"])
+
+        return len(documents)
+
+
+def as_utc(moment: datetime) -> datetime:
+    """
+    Get a datetime as naive UTC, the way MongoDB returns it
+
+    Args:
+        - `moment`: A naive UTC or timezone aware datetime
+    """
+    if moment.tzinfo is None:
+        return moment
+
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class MemoryRevokedTokenRepository(RevokedTokenRepository):
+    """
+    Revoked tokens stored in this process's memory. Expired records are
+    ignored rather than removed, like a MongoDB TTL index that hasn't run
+    """
+
+    def __init__(self):
+        self.expiry: Dict[str, datetime] = {}
+        """Expiry of each revoked token by ID"""
+
+    def active(self, jti: str) -> bool:
+        expires_at = self.expiry.get(jti)
+
+        return expires_at is not None and expires_at > datetime.utcnow()
+
+    async def add(self, jti: str, expires_at: datetime):
+        if self.active(jti):
+            raise duplicate_key_error("revoked_tokens", "jti", jti)
+
+        self.expiry[jti] = as_utc(expires_at)
+
+    async def exists(self, jti: str):
+        return self.active(jti)
+
+    async def ids(self):
+        for jti in list(self.expiry):
+            if self.active(jti):
+                yield jti
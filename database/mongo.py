@@ -0,0 +1,334 @@
+import re
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+from beanie import PydanticObjectId
+from bson import Timestamp
+from pymongo import DeleteMany, ReturnDocument, UpdateMany
+from pymongo.errors import BulkWriteError
+from pymongo.read_preferences import (
+    Nearest,
+    PrimaryPreferred,
+    ReadPreference,
+    Secondary,
+    SecondaryPreferred,
+)
+
+import config
+from database.repository import (
+    Document,
+    Fields,
+    RevokedTokenRepository,
+    Selection,
+    UserRepository,
+)
+from models.security import RevokedToken, RevokedTokenId
+from models.user import User
+from utils.list import chunker
+
+settings = config.get_settings()
+
+READ_PREFERENCES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+"""Read preference classes by mode name, other than primary"""
+
+
+def read_preference(mode: str, max_staleness: int = -1):
+    """
+    Make a read preference from its settings
+
+    Args:
+        - `mode`: `primary`, `primaryPreferred`, `secondary`,
+          `secondaryPreferred` or `nearest`
+        - `max_staleness`: Seconds a replica can lag behind the primary and
+          still be read from, -1 for no limit (otherwise at least 90)
+    """
+    if mode == "primary":
+        return ReadPreference.PRIMARY
+
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference '{mode}'")
+
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+
+def projection(fields: Fields):
+    """
+    Make a MongoDB projection from a list of fields
+
+    Args:
+        - `fields`: Fields to return, None for all
+    """
+    return None if fields is None else list(fields)
+
+
+class MongoUserRepository(UserRepository):
+    """
+    Users stored in the MongoDB collection of the Beanie `User` model.
+    Writes go to the primary, reads use `DB_READ_PREFERENCE`
+    """
+
+    def __init__(self):
+        self.read_preference = read_preference(
+            settings.DB_READ_PREFERENCE, settings.DB_MAX_STALENESS_SECONDS
+        )
+        self.replicas = self.read_preference != ReadPreference.PRIMARY
+        """Whether reads can be served by replicas lagging behind writes"""
+
+        self.read_collection = None
+        """The collection with the read preference"""
+
+        self.last_seen: Tuple[dict, Timestamp] = None
+        """Cluster and operation time of the latest operation"""
+
+    @property
+    def collection(self):
+        return User.get_motor_collection()
+
+    @property
+    def reads(self):
+        """The collection, reading with the configured read preference"""
+
+        collection = self.collection
+
+        if not self.replicas:
+            return collection
+
+        # Beanie replaces the collection when it is initialized again
+        if (
+            self.read_collection is None
+            or self.read_collection.name != collection.name
+            or self.read_collection.database is not collection.database
+        ):
+            self.read_collection = collection.with_options(
+                read_preference=self.read_preference
+            )
+
+        return self.read_collection
+
+    @asynccontextmanager
+    async def session(self):
+        """
+        Start a causally consistent session that continues from this
+        worker's latest operation, so reads from a replica wait until it
+        has every write this worker made. Yields None when reads go to the
+        primary, which always has them
+        """
+        if not self.replicas:
+            yield None
+            return
+
+        client = self.collection.database.client
+
+        async with await client.start_session(
+            causal_consistency=True
+        ) as session:
+            if self.last_seen is not None:
+                session.advance_cluster_time(self.last_seen[0])
+                session.advance_operation_time(self.last_seen[1])
+
+            try:
+                yield session
+            finally:
+                operation_time = session.operation_time
+
+                if operation_time is not None and (
+                    self.last_seen is None
+                    or operation_time > self.last_seen[1]
+                ):
+                    self.last_seen = (session.cluster_time, operation_time)
+
+    async def find_one(self, query: dict, fields: Fields, primary: bool):
+        """
+        Read one user. A user missing from a replica is read again from the
+        primary, it may have just been created by another worker
+
+        Args:
+            - `query`: The user's filter
+            - `fields`: Fields to return
+            - `primary`: Only read from the primary
+        """
+        async with self.session() as session:
+            collection = self.collection if primary else self.reads
+            document = await collection.find_one(
+                query, projection(fields), session=session
+            )
+
+            if document is None and self.replicas and not primary:
+                document = await self.collection.find_one(
+                    query, projection(fields), session=session
+                )
+
+        return document
+
+    async def find_by_id(
+        self,
+        id: PydanticObjectId,
+        fields: Fields = None,
+        primary: bool = False,
+    ):
+        return await self.find_one({"_id": id}, fields, primary)
+
+    async def find_by_email(
+        self, email: str, fields: Fields = None, primary: bool = False
+    ):
+        return await self.find_one({"email": email}, fields, primary)
+
+    async def insert(self, document: Document):
+        async with self.session() as session:
+            await self.collection.insert_one(document, session=session)
+
+    async def insert_many(self, documents: List[Document]):
+        try:
+            async with self.session() as session:
+                await self.collection.insert_many(
+                    documents, ordered=False, session=session
+                )
+        except BulkWriteError as error:
+            return {
+                write_error["index"]: write_error
+                for write_error in error.details["writeErrors"]
+            }
+
+        return {}
+
+    async def update(
+        self,
+        id: PydanticObjectId,
+        changes: Dict[str, Any],
+        fields: Fields = None,
+        expected: Dict[str, Any] = None,
+    ):
+        async with self.session() as session:
+            return await self.collection.find_one_and_update(
+                {**(expected or {}), "_id": id},
+                {"$set": changes},
+                projection=projection(fields),
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+
+    async def delete(self, id: PydanticObjectId):
+        async with self.session() as session:
+            result = await self.collection.delete_one(
+                {"_id": id}, session=session
+            )
+
+        return result.deleted_count > 0
+
+    async def find_page(
+        self,
+        sort: str,
+        direction: int,
+        limit: int,
+        fields: Fields = None,
+        bound: Tuple[str, Any] = None,
+    ):
+        query = {} if bound is None else {sort: {bound[0]: bound[1]}}
+
+        async with self.session() as session:
+            cursor = (
+                self.reads.find(query, projection(fields), session=session)
+                .sort(sort, direction)
+                .limit(limit)
+            )
+
+            return [document async for document in cursor]
+
+    async def count(self):
+        return await self.reads.estimated_document_count()
+
+    async def iterate(self, fields: Fields = None, batch_size: int = 1000):
+        async with self.session() as session:
+            cursor = self.reads.find(
+                {},
+                projection=projection(fields),
+                batch_size=batch_size,
+                session=session,
+            )
+
+            async for document in cursor:
+                yield document
+
+    def writes(self, selection: Selection, operation, *args, batch_size):
+        """
+        Make the writes for a selection. A filter selection is a single
+        write, an ID selection is a write per batch of IDs
+
+        Args:
+            - `selection`: The users to write to
+            - `operation`: `UpdateMany` or `DeleteMany`
+            - `args`: Arguments of the operation after the filter
+            - `batch_size`: IDs per write
+        """
+        selection.check()
+        query = {}
+
+        if selection.exclude_id is not None:
+            query["_id"] = {"$ne": selection.exclude_id}
+
+        if selection.email_domain:
+            domain = re.escape(selection.email_domain)
+            query["email"] = {"$regex": f"@{domain}$", "$options": "i"}
+
+        if not selection.ids:
+            return [operation(query, *args)]
+
+        return [
+            operation(
+                {**query, "_id": {**query.get("_id", {}), "$in": ids}}, *args
+            )
+            for ids in chunker(selection.ids, batch_size)
+        ]
+
+    async def update_many(
+        self,
+        selection: Selection,
+        changes: Dict[str, Any],
+        batch_size: int = 1000,
+    ):
+        writes = self.writes(
+            selection, UpdateMany, {"$set": changes}, batch_size=batch_size
+        )
+
+        async with self.session() as session:
+            result = await self.collection.bulk_write(
+                writes, ordered=False, session=session
+            )
+
+        return result.matched_count, result.modified_count
+
+    async def delete_many(self, selection: Selection, batch_size: int = 1000):
+        writes = self.writes(selection, DeleteMany, batch_size=batch_size)
+
+        async with self.session() as session:
+            result = await self.collection.bulk_write(
+                writes, ordered=False, session=session
+            )
+
+        return result.deleted_count
+
+
+class MongoRevokedTokenRepository(RevokedTokenRepository):
+    """
+    Revoked tokens stored with the Beanie `RevokedToken` model. MongoDB
+    removes a record once its token has expired
+    """
+
+    async def add(self, jti: str, expires_at: datetime):
+        await RevokedToken(jti=jti, expires_at=expires_at).insert()
+
+    async def exists(self, jti: str):
+        revoked = await RevokedToken.find_one(RevokedToken.jti == jti)
+
+        return revoked is not None
+
+    async def ids(self):
+        async for revoked in RevokedToken.find_all(
+            projection_model=RevokedTokenId
+        ):
+            yield revoked.jti
@@ -0,0 +1,220 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+from beanie import PydanticObjectId
+
+Document = Dict[str, Any]
+"""A user document as stored, keyed by field alias (`_id`, `email`...)"""
+
+Fields = Optional[Iterable[str]]
+"""Fields to return, `_id` is always included. None returns every field"""
+
+
+class Selection(NamedTuple):
+    """Users selected by a bulk operation"""
+
+    ids: Optional[List[PydanticObjectId]] = None
+    """Only these users"""
+    email_domain: Optional[str] = None
+    """Only users with an email at this domain (case insensitive)"""
+    exclude_id: Optional[PydanticObjectId] = None
+    """Never this user"""
+
+    def check(self):
+        """
+        Refuse a selection of every user, which a missing or empty `ids` and
+        `email_domain` would otherwise be
+        """
+        if not self.ids and not self.email_domain:
+            raise ValueError("A selection needs ids or an email domain")
+
+
+class UserRepository(ABC):
+    """
+    Storage of user documents. Implementations enforce a unique email and
+    raise `pymongo.errors.DuplicateKeyError` when it is violated. Reads may
+    be served by replicas that lag behind other processes' writes, unless
+    `primary` is set
+    """
+
+    @abstractmethod
+    async def find_by_id(
+        self,
+        id: PydanticObjectId,
+        fields: Fields = None,
+        primary: bool = False,
+    ) -> Optional[Document]:
+        """
+        Get a user by id, or None if there is no such user
+
+        Args:
+            - `id`: The MongoDB id of the user
+            - `fields`: Fields to return
+            - `primary`: Read the latest write
+        """
+
+    @abstractmethod
+    async def find_by_email(
+        self, email: str, fields: Fields = None, primary: bool = False
+    ) -> Optional[Document]:
+        """
+        Get a user by email, or None if there is no such user
+
+        Args:
+            - `email`: The user's email
+            - `fields`: Fields to return
+            - `primary`: Read the latest write
+        """
+
+    @abstractmethod
+    async def insert(self, document: Document):
+        """
+        Insert a user
+
+        Args:
+            - `document`: The user, including its `_id`
+        """
+
+    @abstractmethod
+    async def insert_many(
+        self, documents: List[Document]
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Insert users without stopping at the first failure. Returns the
+        errors (`code` and `errmsg`) keyed by the position of the document
+
+        Args:
+            - `documents`: The users, including their `_id`
+        """
+
+    @abstractmethod
+    async def update(
+        self,
+        id: PydanticObjectId,
+        changes: Dict[str, Any],
+        fields: Fields = None,
+        expected: Dict[str, Any] = None,
+    ) -> Optional[Document]:
+        """
+        Set fields of a user. Returns the updated user, or None if there is
+        no such user or it doesn't match `expected`
+
+        Args:
+            - `id`: The MongoDB id of the user
+            - `changes`: Values to set by field
+            - `fields`: Fields to return
+            - `expected`: Values the user must have to be updated
+        """
+
+    @abstractmethod
+    async def delete(self, id: PydanticObjectId) -> bool:
+        """
+        Delete a user. Returns False if there is no such user
+
+        Args:
+            - `id`: The MongoDB id of the user
+        """
+
+    @abstractmethod
+    async def find_page(
+        self,
+        sort: str,
+        direction: int,
+        limit: int,
+        fields: Fields = None,
+        bound: Tuple[str, Any] = None,
+    ) -> List[Document]:
+        """
+        Get users in order of a unique field
+
+        Args:
+            - `sort`: The field to sort by
+            - `direction`: `pymongo.ASCENDING` or `pymongo.DESCENDING`
+            - `limit`: Maximum number of users
+            - `fields`: Fields to return
+            - `bound`: Only users past a value, as (`$gt` or `$lt`, value)
+        """
+
+    @abstractmethod
+    async def count(self) -> int:
+        """Get the (possibly estimated) number of users"""
+
+    @abstractmethod
+    def iterate(
+        self, fields: Fields = None, batch_size: int = 1000
+    ) -> AsyncIterator[Document]:
+        """
+        Iterate over every user
+
+        Args:
+            - `fields`: Fields to return
+            - `batch_size`: Number of users fetched at a time
+        """
+
+    @abstractmethod
+    async def update_many(
+        self,
+        selection: Selection,
+        changes: Dict[str, Any],
+        batch_size: int = 1000,
+    ) -> Tuple[int, int]:
+        """
+        Set fields of the selected users. Returns the number of users matched
+        and modified
+
+        Args:
+            - `selection`: The users to update
+            - `changes`: Values to set by field
+            - `batch_size`: IDs per write
+        """
+
+    @abstractmethod
+    async def delete_many(
+        self, selection: Selection, batch_size: int = 1000
+    ) -> int:
+        """
+        Delete the selected users. Returns the number deleted
+
+        Args:
+            - `selection`: The users to delete
+            - `batch_size`: IDs per write
+        """
+
+
+class RevokedTokenRepository(ABC):
+    """
+    Storage of revoked token IDs. A record is dropped once its token has
+    expired. Adding an ID twice raises `pymongo.errors.DuplicateKeyError`
+    """
+
+    @abstractmethod
+    async def add(self, jti: str, expires_at: datetime):
+        """
+        Record a revoked token
+
+        Args:
+            - `jti`: The token's unique ID
+            - `expires_at`: When the token expires
+        """
+
+    @abstractmethod
+    async def exists(self, jti: str) -> bool:
+        """
+        Check for a revoked token
+
+        Args:
+            - `jti`: The token's unique ID
+        """
+
+    @abstractmethod
+    def ids(self) -> AsyncIterator[str]:
+        """Iterate over the IDs of every revoked token"""
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
+
+import database.backend as backend
+
+
+async def revoke_token(jti: str, expires_at: datetime):
+    """
+    Record a token as revoked. The record is removed by the database once
+    the token would have expired anyway
+
+    Args:
+        - `jti`: The token's unique ID
+        - `expires_at`: When the token expires
+    """
+    try:
+        await backend.revoked_tokens.add(jti, expires_at)
+    except DuplicateKeyError:
+        pass
+
+
+async def is_token_revoked(jti: str) -> bool:
+    """
+    Check the database for a revoked token
+
+    Args:
+        - `jti`: The token's unique ID
+    """
+    return await backend.revoked_tokens.exists(jti)
+
+
+async def get_revoked_token_ids():
+    """Iterate over the IDs of every revoked token"""
+
+    async for jti in backend.revoked_tokens.ids():
+        yield jti
@@ -1,82 +1,547 @@
+import base64
+import binascii
+from typing import (
+    Any,
+    AsyncIterable,
+    Dict,
+    Iterable,
+    List,
+    Tuple,
+    Union,
+)
 from fastapi import HTTPException, status
 from beanie import PydanticObjectId
+from beanie.odm.utils.projection import get_projection
+from bson.errors import InvalidId
+from pydantic import ValidationError, validate_model
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
 
+import config
 import auth.security as security
 
 import models.user as models
+import database.backend as backend
+from database.repository import Selection
+from models.security import Principal
+from utils.cache import TTLCache
+from utils.list import async_chunker
+
+settings = config.get_settings()
+
+principal_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL
+)
+"""Authenticated users keyed by email. Invalidated on edit and delete"""
+
+principal_emails: Dict[PydanticObjectId, str] = {}
+"""Email of each cached principal by user id, to invalidate it by id"""
+
+count_cache = TTLCache(maxsize=1, ttl=settings.USERS_COUNT_TTL)
+"""Estimated number of users"""
+
+
+def build_user_out(document: Dict[str, Any]) -> models.UserOut:
+    """
+    Build a `UserOut` from a projected user document without validating it
+    again, the document was validated when it was written
+
+    Args:
+        - `document`: A user document projected to `UserOut`'s fields
+    """
+    return models.UserOut.construct(**document)
+
+
+def new_user_document(**fields) -> Dict[str, Any]:
+    """
+    Validate a new user against `models.User` and make the document to
+    store, with a new `_id`. Raises `ValidationError` if a field is invalid
+
+    Args:
+        - `fields`: The user's fields
+    """
+    values, _, error = validate_model(
+        models.User, {"id": PydanticObjectId(), **fields}
+    )
+
+    if error:
+        raise error
+
+    values.pop("revision_id", None)
+    values["_id"] = values.pop("id")
+
+    return values
 
 
 async def get_user(id: PydanticObjectId):
-    db_user = await models.User.find_one(models.User.id == id)
+    db_user = await backend.users.find_by_id(
+        id, get_projection(models.UserOut)
+    )
 
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
 
-    return db_user
+    return build_user_out(db_user)
 
 
 async def get_user_by_email(email: str):
-    return await models.User.find_one(models.User.email == email)
+    db_user = await backend.users.find_by_email(email)
 
+    return None if db_user is None else models.User.construct(**db_user)
 
-async def create_user(user: models.UserCreate):
-    db_user = await get_user_by_email(user.email)
 
-    if db_user is not None:
+async def get_user_auth(email: str):
+    """
+    Get the fields needed to log a user in, skipping the user's profile
+
+    Args:
+        - `email`: The user's email
+    """
+    # Always current, a stale password or role must not be accepted
+    db_user = await backend.users.find_by_email(
+        email, get_projection(models.UserAuthView), primary=True
+    )
+
+    return None if db_user is None else models.UserAuthView.parse_obj(db_user)
+
+
+async def get_principal(email: str):
+    """
+    Get the cached principal for an email, reading the user from the
+    database on a miss. Returns None if the user does not exist
+
+    Args:
+        - `email`: The user's email
+    """
+    principal: Principal = principal_cache.get(email)
+
+    if principal is not None:
+        return principal
+
+    db_user = await backend.users.find_by_email(
+        email, get_projection(Principal)
+    )
+
+    if db_user is None:
+        return None
+
+    principal = Principal.parse_obj(db_user)
+
+    principal_cache.set(email, principal)
+    principal_emails[principal.id] = email
+
+    # Principals evicted from the cache leave their ids behind, drop them
+    # once there are many
+    if len(principal_emails) > 2 * max(1, settings.PRINCIPAL_CACHE_SIZE):
+        principal_emails.clear()
+        principal_emails.update(
+            (cached.id, email) for email, cached in principal_cache.items()
+        )
+
+    return principal
+
+
+def forget_principal(id: PydanticObjectId):
+    """
+    Drop a user's cached principal so changes take effect on the next
+    request. Only this worker's cache is cleared, other workers pick the
+    change up within `PRINCIPAL_CACHE_TTL`
+
+    Args:
+        - `id`: The MongoDB id of the user
+    """
+    email = principal_emails.pop(id, None)
+
+    if email is not None:
+        principal_cache.pop(email)
+
+
+def forget_principals():
+    """Drop every cached principal of this worker"""
+
+    principal_cache.clear()
+    principal_emails.clear()
+
+
+async def insert_user(user: models.UserCreate):
+    """
+    Insert a new user, relying on the unique email index to reject
+    duplicates. Raises `DuplicateKeyError` if the email is taken, and a 422
+    `HTTPException` if a field is invalid
+
+    Args:
+        - `user`: The user to create
+    """
+    # Validated before hashing, invalid input must not cost a bcrypt run
+    try:
+        document = new_user_document(
+            first_name=user.first_name,
+            last_name=user.last_name,
+            email=user.email,
+            is_active=user.is_active,
+            is_super_user=user.is_super_user,
+            hashed_password="",
+        )
+    except ValidationError as error:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=error.errors(),
+        )
+
+    document["hashed_password"] = await security.get_password_hash_async(
+        user.password
+    )
+
+    await backend.users.insert(document)
+
+    return models.User.construct(**document)
+
+
+async def create_user(user: models.UserCreate):
+    try:
+        return await insert_user(user)
+    except DuplicateKeyError:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="User already exists",
         )
 
-    hashed_password = security.get_password_hash(user.password)
 
-    db_user = models.User(
-        first_name=user.first_name,
-        last_name=user.last_name,
-        email=user.email,
-        is_active=user.is_active,
-        is_super_user=user.is_super_user,
-        hashed_password=hashed_password,
+async def import_users(
+    records: Union[Iterable[Any], AsyncIterable[Any]], batch_size: int = 1000
+):
+    """
+    Create users in bulk. Passwords are hashed across the hashing pool and
+    each batch is written with one unordered insert, so a bad record
+    doesn't stop the rest. Records are read a batch at a time. Returns a
+    result for every record
+
+    Args:
+        - `records`: Raw user records (see `models.UserImport`)
+        - `batch_size`: Number of records hashed and inserted together
+    """
+    results: List[models.UserImportResult] = []
+    start = 0
+
+    async for batch in async_chunker(records, batch_size):
+        users: List[Tuple[int, models.UserImport]] = []
+
+        for index, record in enumerate(batch, start):
+            try:
+                users.append((index, models.UserImport.parse_obj(record)))
+            except ValidationError as error:
+                results.append(
+                    models.UserImportResult(
+                        index=index, error=format_validation_error(error)
+                    )
+                )
+
+        start += len(batch)
+
+        if not users:
+            continue
+
+        try:
+            hashed_passwords = await security.get_password_hashes_async(
+                [user.password for _, user in users]
+            )
+        except Exception as error:
+            # Earlier batches are already created, report the batch as
+            # failed rather than losing the whole report
+            detail = (
+                error.detail
+                if isinstance(error, HTTPException)
+                else repr(error)
+            )
+            results.extend(
+                models.UserImportResult(
+                    index=index, email=user.email, error=detail
+                )
+                for index, user in users
+            )
+            continue
+
+        documents = [
+            new_user_document(
+                hashed_password=hashed_password,
+                **user.dict(exclude={"password"}),
+            )
+            for (_, user), hashed_password in zip(users, hashed_passwords)
+        ]
+
+        errors: Dict[int, str] = {
+            position: (
+                "User already exists"
+                if write_error["code"] == 11000
+                else write_error["errmsg"]
+            )
+            for position, write_error in (
+                await backend.users.insert_many(documents)
+            ).items()
+        }
+
+        for position, ((index, user), document) in enumerate(
+            zip(users, documents)
+        ):
+            error = errors.get(position)
+
+            results.append(
+                models.UserImportResult(
+                    index=index,
+                    email=user.email,
+                    id=None if error else document["_id"],
+                    error=error,
+                )
+            )
+
+    results.sort(key=lambda result: result.index)
+    failed = sum(1 for result in results if result.error is not None)
+
+    return models.UserImportReport(
+        created=len(results) - failed, failed=failed, results=results
     )
 
-    await db_user.save()
 
-    return db_user
+def format_validation_error(error: ValidationError) -> str:
+    """
+    Summarise a validation error on one line
+
+    Args:
+        - `error`: The validation error
+    """
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in item['loc'])}: {item['msg']}"
+        for item in error.errors()
+    )
 
 
 async def edit_user(id: PydanticObjectId, edit: models.UserEdit):
-    db_user = await get_user(id)
+    new_user_dict = edit.dict(exclude_unset=True)
+    password = new_user_dict.pop("password", None)
+
+    if password is not None:
+        new_user_dict[
+            "hashed_password"
+        ] = await security.get_password_hash_async(password)
+
+    projection = get_projection(models.UserOut)
+
+    # Only the edited fields are written, in a single round trip
+    if new_user_dict:
+        try:
+            db_user = await backend.users.update(id, new_user_dict, projection)
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="User already exists",
+            )
+    else:
+        db_user = await backend.users.find_by_id(id, projection)
 
     if not db_user:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    new_user_dict = edit.dict(exclude_unset=True)
+    forget_principal(id)
 
-    if "password" in new_user_dict:
-        new_user_dict["hashed_password"] = security.get_password_hash(
-            new_user_dict["password"]
-        )
-        del new_user_dict["password"]
+    return models.UserOut.parse_obj(db_user)
 
-    for key, value in new_user_dict.items():
-        setattr(db_user, key, value)
 
-    await db_user.save()
-    return db_user
+async def update_password_hash(
+    id: PydanticObjectId, old_hash: str, new_hash: str
+):
+    """
+    Replace a user's password hash, unless the password was changed since
+    `old_hash` was read
 
+    Args:
+        - `id`: The MongoDB id of the user
+        - `old_hash`: The hash being replaced
+        - `new_hash`: The new hash of the same password
+    """
+    await backend.users.update(
+        id,
+        {"hashed_password": new_hash},
+        fields=["_id"],
+        expected={"hashed_password": old_hash},
+    )
 
-async def delete_user(id: PydanticObjectId):
-    user = await get_user(id)
 
-    if not user:
+async def delete_user(id: PydanticObjectId):
+    if not await backend.users.delete(id):
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    await user.delete()
+    forget_principal(id)
 
     return True
 
 
-async def get_users(limit: int = 100):
-    return await models.User.find({}).limit(limit).to_list()
+ROLES = {
+    "user": {"is_admin_user": False, "is_super_user": False},
+    "admin": {"is_admin_user": True, "is_super_user": False},
+    "super": {"is_admin_user": True, "is_super_user": True},
+}
+"""The flags set for each role"""
+
+
+async def bulk_action(
+    action: models.UserBulkAction,
+    current_user_id: PydanticObjectId,
+    batch_size: int = 1000,
+):
+    """
+    Deactivate, activate, change the role of, or delete every selected user
+    except the current user, so an admin can't lock themselves out. A filter
+    selection is a single write, an ID selection is a write per batch of IDs
+
+    Args:
+        - `action`: The operation and the users to apply it to
+        - `current_user_id`: The MongoDB id of the user making the change
+        - `batch_size`: IDs per write
+    """
+    if not action.ids and not action.email_domain:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="ids or email_domain is required",
+        )
+
+    selection = Selection(
+        ids=action.ids,
+        email_domain=action.email_domain,
+        exclude_id=current_user_id,
+    )
+
+    if action.action == "delete":
+        deleted = await backend.users.delete_many(selection, batch_size)
+        matched = modified = deleted
+        count_cache.clear()
+    else:
+        if action.action == "set_role":
+            changes = ROLES[action.role]
+        else:
+            changes = {"is_active": action.action == "activate"}
+
+        matched, modified = await backend.users.update_many(
+            selection, changes, batch_size
+        )
+
+    # Any cached user may have changed
+    forget_principals()
+
+    return models.UserBulkResult(matched=matched, modified=modified)
+
+
+def encode_cursor(user: models.UserOut, sort: str) -> str:
+    """
+    Make an opaque page cursor from a user's sort field value
+
+    Args:
+        - `user`: The user at the edge of a page
+        - `sort`: The field the page is sorted by
+    """
+    value = str(user.id) if sort == "_id" else getattr(user, sort)
+
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: str):
+    """
+    Get the sort field value from a page cursor
+
+    Args:
+        - `cursor`: A cursor made by `encode_cursor`
+        - `sort`: The field the page is sorted by
+    """
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode()).decode()
+
+        return PydanticObjectId(value) if sort == "_id" else value
+    except (binascii.Error, UnicodeDecodeError, InvalidId):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+async def get_users(
+    limit: int = 100,
+    after: str = None,
+    before: str = None,
+    sort: str = "_id",
+    order: str = "asc",
+):
+    """
+    Get a page of users using keyset pagination, so every page costs the
+    same however deep it is. Returns the users and the cursors of the next
+    and previous pages (None when there is no such page)
+
+    Args:
+        - `limit`: Page size
+        - `after`: Cursor of the page before this one
+        - `before`: Cursor of the page after this one
+        - `sort`: Unique field to sort by (`_id` or `email`)
+        - `order`: Sort order (`asc` or `desc`)
+    """
+    direction = ASCENDING if order == "asc" else DESCENDING
+    bound = None
+
+    if after is not None:
+        operator = "$gt" if direction == ASCENDING else "$lt"
+        bound = (operator, decode_cursor(after, sort))
+    elif before is not None:
+        operator = "$lt" if direction == ASCENDING else "$gt"
+        bound = (operator, decode_cursor(before, sort))
+        # Walk backwards from the cursor, the page is put back in order below
+        direction = -direction
+
+    documents = await backend.users.find_page(
+        sort, direction, limit + 1, get_projection(models.UserOut), bound
+    )
+    users = [build_user_out(document) for document in documents]
+
+    more = len(users) > limit
+    users = users[:limit]
+
+    if before is not None:
+        users.reverse()
+
+    if not users:
+        return users, None, None
+
+    has_next = more if before is None else True
+    has_previous = more if before is not None else after is not None
+
+    next_cursor = encode_cursor(users[-1], sort) if has_next else None
+    previous_cursor = encode_cursor(users[0], sort) if has_previous else None
+
+    return users, next_cursor, previous_cursor
+
+
+async def count_users() -> int:
+    """
+    Get the estimated number of users from collection metadata, cached for
+    `USERS_COUNT_TTL` seconds
+    """
+    total = count_cache.get("users")
+
+    if total is None:
+        total = await backend.users.count()
+        count_cache.set("users", total)
+
+    return total
+
+
+async def iter_users(batch_size: int = 1000):
+    """
+    Stream every user as a plain `UserOut` shaped dict straight from the
+    database, without loading the collection into memory
+
+    Args:
+        - `batch_size`: Number of users fetched per round trip
+    """
+    fields = [field.alias for field in models.UserOut.__fields__.values()]
+    async for document in backend.users.iterate(fields, batch_size):
+        row = {field: document.get(field) for field in fields}
+        row["_id"] = str(row["_id"])
+
+        yield row
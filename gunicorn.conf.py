@@ -0,0 +1,12 @@
+"""
+Gunicorn settings, see startup.sh
+
+Info: https://docs.gunicorn.org/en/stable/settings.html
+"""
+from utils.metrics import mark_process_dead
+
+
+def child_exit(server, worker):
+    """Drop the live metrics of a worker that exited"""
+
+    mark_process_dead(worker.pid)
@@ -1,12 +1,23 @@
+# First, so the import time covers every other import
+from utils.startup import report as startup
+
 import uvicorn
 import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 import config
+import auth.security as security
+from auth.revocation import revocations
+import database.backend as backend
 import utils.mongo as mongodb
+from utils.metrics import MetricsMiddleware
+from utils.profiling import PROFILE_ID_HEADER, ProfilingMiddleware
+from utils.query_log import QUERY_COUNT_HEADER, QueryCountMiddleware
+
+from routes import auth, health, metrics, profiles, user
 
-from routes import auth, user
+startup.mark("imports")
 
 app = FastAPI(title="Daniel Smyth API", docs_url="/api/docs")
 
@@ -25,23 +36,111 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "Content-Range",
+        "X-Next-Cursor",
+        "X-Prev-Cursor",
+        QUERY_COUNT_HEADER,
+        PROFILE_ID_HEADER,
+    ],
 )
 
+# Profile requests from superusers sending an X-Profile header
+app.add_middleware(ProfilingMiddleware)
+
+# Count the MongoDB commands of each request
+app.add_middleware(QueryCountMiddleware)
+
+# Outermost, so latency covers every other middleware
+app.add_middleware(MetricsMiddleware)
+
 # Routes
 app.include_router(auth.r)
 app.include_router(user.r)
+app.include_router(metrics.r)
+app.include_router(profiles.r)
+app.include_router(health.r)
 
 
 @app.on_event("startup")
 async def start_database():
-    """Initialize MongoDB connection and Beanie ORM"""
+    """
+    Initialize MongoDB connection and Beanie ORM, or empty in-memory storage
+    when `DB_BACKEND` is `memory`
+    """
+    logger.info(f"CORS: '{FRONT_END_URL}'")
+
+    if settings.DB_BACKEND == "memory":
+        backend.use("memory")
+        logger.warning("Database: in memory, nothing will be persisted")
+        return
+
     db_name = settings.DB_NAME_DEV if ENV == "dev" else settings.DB_NAME
 
-    await mongodb.manager.connect(settings.DB_URL, db_name)
-    await mongodb.manager.init_beanie(db_name)
+    backend.use("mongo")
+
+    with startup.phase("database"):
+        await mongodb.manager.connect(settings.DB_URL, db_name)
+        await mongodb.manager.init_beanie(db_name)
+
+    with startup.phase("database pool"):
+        await mongodb.manager.warm(
+            settings.DB_MIN_POOL_SIZE, settings.DB_WARM_TIMEOUT_MS / 1000
+        )
 
-    logger.info(f"CORS: '{FRONT_END_URL}'")
     logger.info(f"Database: '{db_name}'")
+    logger.info(
+        f"Database pool: {settings.DB_MIN_POOL_SIZE}-"
+        f"{settings.DB_MAX_POOL_SIZE} connections"
+    )
+
+
+@app.on_event("startup")
+async def start_revocation_list():
+    """Load revoked tokens and keep them refreshed"""
+    # Loaded before the worker is ready, an empty filter accepts every token
+    with startup.phase("revocation list"):
+        await revocations.refresh()
+
+    revocations.start(settings.REVOCATION_REFRESH_SECONDS)
+
+
+@app.on_event("shutdown")
+async def stop_revocation_list():
+    """Stop refreshing revoked tokens"""
+    revocations.stop()
+
+
+@app.on_event("startup")
+async def start_hasher():
+    """Start the password hashing process pool"""
+    with startup.phase("hashing pool"):
+        security.hasher.start(
+            settings.HASH_WORKERS,
+            settings.HASH_QUEUE_SIZE,
+            settings.HASH_BULK_JOBS,
+        )
+        await security.hasher.warm()
+
+    logger.info(f"Password hashing workers: {settings.HASH_WORKERS}")
+
+
+@app.on_event("shutdown")
+async def stop_hasher():
+    """Stop the password hashing process pool"""
+    security.hasher.close()
+
+
+@app.on_event("startup")
+async def finish_startup():
+    """
+    Build the OpenAPI schema before the first docs request would, then
+    report the worker ready. Runs after every other startup hook
+    """
+    with startup.phase("openapi"):
+        app.openapi()
+
+    startup.finish()
 
 
 if __name__ == "__main__":
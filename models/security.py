@@ -1,5 +1,10 @@
-from typing import Literal
+from datetime import datetime
+from typing import Literal, Optional
+from beanie import Document, Indexed, PydanticObjectId
 from pydantic import BaseModel
+from pymongo import ASCENDING, IndexModel
+
+from models.user import UserOut
 
 
 class JWTTokenData(BaseModel):
@@ -7,3 +12,59 @@ class JWTTokenData(BaseModel):
 
     email: str = None
     permissions: Literal["user", "admin", "super"]
+
+    jti: Optional[str] = None
+    """The token's unique ID, used for revocation"""
+    exp: Optional[datetime] = None
+    """When the token expires"""
+
+    id: Optional[PydanticObjectId] = None
+    """Claims-only tokens: the user's MongoDB ID"""
+    is_active: Optional[bool] = None
+    """Claims-only tokens: the user's active flag"""
+    is_admin_user: Optional[bool] = None
+    """Claims-only tokens: the user's admin flag"""
+    is_super_user: Optional[bool] = None
+    """Claims-only tokens: the user's super user flag"""
+
+    @property
+    def has_claims(self) -> bool:
+        """Whether the token carries the claims needed to authorize alone"""
+
+        return None not in (
+            self.id,
+            self.is_active,
+            self.is_admin_user,
+            self.is_super_user,
+        )
+
+
+class Principal(UserOut):
+    """
+    An immutable snapshot of an authenticated user, without credentials.
+    Cached per worker so requests can authorize without a database read
+    """
+
+    class Config:
+        frozen = True
+        allow_population_by_field_name = True
+
+
+class RevokedToken(Document):
+    """A revoked access token as it is stored in a MongoDB database"""
+
+    jti: Indexed(str, unique=True)
+    expires_at: datetime
+    """Removed by MongoDB after this time"""
+
+    class Settings:
+        name = "revoked_tokens"
+        indexes = [
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)
+        ]
+
+
+class RevokedTokenId(BaseModel):
+    """Projection of a revoked token's ID"""
+
+    jti: str
@@ -1,6 +1,6 @@
-from typing import Optional
+from typing import List, Literal, Optional
 from beanie import Document, Indexed, PydanticObjectId
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, root_validator, validator
 
 
 class User(Document):
@@ -37,3 +37,85 @@ class UserEdit(UserBase):
 class UserOut(UserBase):
     id: PydanticObjectId = Field(..., alias="_id")
     """The objects MongoDB ID"""
+
+
+class UserAuthView(BaseModel):
+    """Projection of a user document with only what is needed to log in"""
+
+    id: PydanticObjectId = Field(..., alias="_id")
+    email: str
+    hashed_password: str
+    is_active: bool = True
+    is_admin_user: bool = True
+    is_super_user: bool = True
+
+
+class UserImport(UserCreate):
+    """A user record in a bulk import"""
+
+    email: EmailStr
+
+
+class UserImportResult(BaseModel):
+    """The outcome of importing one record"""
+
+    index: int
+    """The record's position in the import"""
+    email: str = None
+    id: PydanticObjectId = None
+    """The created user's MongoDB ID"""
+    error: str = None
+    """Why the record was not imported"""
+
+
+class UserImportReport(BaseModel):
+    """The outcome of a bulk import"""
+
+    created: int
+    failed: int
+    results: List[UserImportResult]
+
+
+class UserBulkAction(BaseModel):
+    """
+    An operation on every user matching `ids` and/or `email_domain`. At
+    least one of them is required
+    """
+
+    action: Literal["deactivate", "activate", "set_role", "delete"]
+    role: Literal["user", "admin", "super"] = None
+    """The role to give the users, for `set_role`"""
+    ids: List[PydanticObjectId] = None
+    """Select users by MongoDB ID"""
+    email_domain: str = None
+    """Select users by email domain, for example `example.com`"""
+
+    @validator("email_domain")
+    def check_email_domain(cls, email_domain):
+        if email_domain is None:
+            return None
+
+        # "@example.com " selects the same users as "example.com"
+        email_domain = email_domain.strip().lstrip("@").lower()
+
+        if not email_domain:
+            raise ValueError("email_domain must not be empty")
+
+        return email_domain
+
+    @root_validator(skip_on_failure=True)
+    def check_selection(cls, values):
+        if not values.get("ids") and not values.get("email_domain"):
+            raise ValueError("ids or email_domain is required")
+
+        if values.get("action") == "set_role" and not values.get("role"):
+            raise ValueError("role is required for set_role")
+
+        return values
+
+
+class UserBulkResult(BaseModel):
+    """The outcome of a bulk operation"""
+
+    matched: int
+    modified: int
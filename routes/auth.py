@@ -1,6 +1,9 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Body, Depends, Request
 from fastapi.security import OAuth2PasswordRequestForm
 
+import auth.jwt as auth
+import auth.security as security
+import auth.throttle as throttle
 import database.auth as db
 
 r = APIRouter(
@@ -10,28 +13,65 @@ r = APIRouter(
 
 
 @r.post("/token")
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+async def login(
+    request: Request, form_data: OAuth2PasswordRequestForm = Depends()
+):
     """
     Log in a user and return a client access token containing the user's
-    permissions
+    permissions. Attempts are rate limited per client IP and per account
 
     Args:
         - `form_data`: The form data containing user details
     """
+    throttle.check_login(throttle.client_ip(request), form_data.username)
+
     access_token = await db.login_user(form_data)
 
     return access_token
 
 
 @r.post("/signup")
-async def signup(form_data: OAuth2PasswordRequestForm = Depends()):
+async def signup(
+    request: Request, form_data: OAuth2PasswordRequestForm = Depends()
+):
     """
     Sign up a user and return a client access token containing the user's
-    permissions
+    permissions. Attempts are rate limited per client IP
 
     Args:
         - `form_data`: The form data containing user details
     """
+    throttle.check_signup(throttle.client_ip(request))
+
     access_token = await db.signup_user(form_data)
 
     return access_token
+
+
+@r.post("/logout", response_model=bool)
+async def logout(token: str = Depends(security.oauth2_scheme)):
+    """
+    Log out a user by revoking their access token
+
+    Args:
+        - `token`: OAuth2 token
+    """
+    return await db.logout_user(token)
+
+
+@r.post(
+    "/revoke",
+    response_model=bool,
+    dependencies=[Depends(auth.get_active_user)],
+)
+async def revoke(
+    jti: str = Body(embed=True),
+    admin=Depends(auth.get_current_active_admin_from_db),
+):
+    """
+    Revoke an access token
+
+    Args:
+        - `jti`: The unique ID of the token to revoke
+    """
+    return await db.revoke_token(jti)
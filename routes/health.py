@@ -0,0 +1,28 @@
+from fastapi import APIRouter, HTTPException, status
+
+from utils.startup import report
+
+r = APIRouter(tags=["Health"], prefix="/health")
+
+
+@r.get("/live")
+async def health_live():
+    """The worker is running"""
+
+    return {"status": "live"}
+
+
+@r.get("/ready")
+async def health_ready():
+    """
+    The worker has connected to the database and finished starting, so it
+    can take requests. Returns how long each startup phase took in seconds
+    """
+    if not report.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Starting",
+            headers={"Retry-After": "1"},
+        )
+
+    return {"status": "ready", "startup": report.phases}
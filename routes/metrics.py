@@ -0,0 +1,32 @@
+import secrets
+from fastapi import APIRouter, Header, HTTPException, Response, status
+
+import config
+import utils.metrics as metrics
+
+settings = config.get_settings()
+
+r = APIRouter(tags=["Metrics"])
+
+
+@r.get("/metrics", include_in_schema=False)
+async def metrics_get(authorization: str = Header(None)):
+    """
+    Get metrics of every worker in the Prometheus text format. When
+    `METRICS_TOKEN` is set it must be sent as a bearer token
+
+    Args:
+        - `authorization`: `Bearer <METRICS_TOKEN>`
+    """
+    if settings.METRICS_TOKEN and not secrets.compare_digest(
+        authorization or "", f"Bearer {settings.METRICS_TOKEN}"
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    content, media_type = metrics.render()
+
+    return Response(content=content, media_type=media_type)
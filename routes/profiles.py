@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse
+
+import auth.jwt as auth
+import utils.profiling as profiling
+
+r = APIRouter(
+    tags=["Profiling Routes"],
+    prefix="/profiles",
+    dependencies=[Depends(auth.get_active_user)],
+)
+
+
+@r.get("/{id}")
+async def profile_get(
+    id: str, superuser=Depends(auth.get_current_active_superuser)
+):
+    """
+    Download a request profile. Send `X-Profile: collapsed` (for flame
+    graphs) or `X-Profile: pstats` with a request to profile it, the
+    profile's ID is returned in the `X-Profile-Id` header
+
+    Args:
+        - `id`: The profile's ID
+    """
+    path = profiling.find_profile(id)
+
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found"
+        )
+
+    return FileResponse(
+        path, media_type="application/octet-stream", filename=path.name
+    )
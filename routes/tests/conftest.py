@@ -1,3 +1,4 @@
+import os
 import pytest
 from typing import AsyncGenerator, Dict
 from httpx import AsyncClient
@@ -5,7 +6,11 @@ from httpx import AsyncClient
 
 import main
 import config
+import auth.jwt
 import auth.security
+import auth.throttle
+import database.backend
+import database.user
 import utils.mongo
 
 from models.user import User
@@ -13,6 +18,9 @@ from models.user import User
 
 settings = config.get_settings()
 
+DB_BACKEND = os.getenv("TEST_DB_BACKEND", "memory")
+"""Run the tests in memory, or against `DB_URL` with `mongo`"""
+
 
 def get_password_hash() -> str:
     """
@@ -29,27 +37,47 @@ def verify_password_mock(first: str, second: str):
     return True
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """
+    Users are recreated for every test, so cached tokens, principals and
+    login limits must not leak between tests
+    """
+    auth.jwt.token_cache.clear()
+    database.user.forget_principals()
+    database.user.count_cache.clear()
+    auth.throttle.ip_limiter.clear()
+    auth.throttle.account_limiter.clear()
+
+
+async def insert_user(**fields) -> User:
+    """
+    Insert a user straight into the database, skipping the API
+    """
+    document = database.user.new_user_document(**fields)
+
+    await database.backend.users.insert(document)
+
+    return User.construct(**document)
+
+
 @pytest.fixture
 def test_password() -> str:
     return "securepassword"
 
 
 @pytest.fixture
-async def test_superuser() -> User:
+async def test_superuser(db) -> User:
     """
     Make a test super user in the database
     """
-    user = User(
+    return await insert_user(
         email="fakesuperuser@email.com",
         hashed_password=get_password_hash(),
         is_super_user=True,
         is_admin_user=True,
     )
 
-    await user.save()
-
-    return user
-
 
 @pytest.fixture
 async def superuser_token_headers(
@@ -80,18 +108,16 @@ async def superuser_token_headers(
 
 
 @pytest.fixture
-async def test_adminuser() -> User:
+async def test_adminuser(db) -> User:
     """
     Make a test admin user in the database
     """
-    user = User(
+    return await insert_user(
         email="fakeadminuser@email.com",
         hashed_password=get_password_hash(),
         is_admin_user=True,
         is_super_user=False,
     )
-    await user.save()
-    return user
 
 
 @pytest.fixture
@@ -123,21 +149,17 @@ async def adminuser_token_headers(
 
 
 @pytest.fixture
-async def test_user() -> User:
+async def test_user(db) -> User:
     """
     Make a test admin user in the database
     """
-    user = User(
+    return await insert_user(
         email="fakeuser@email.com",
         hashed_password=get_password_hash(),
         is_admin_user=False,
         is_super_user=False,
     )
 
-    await user.save()
-
-    return user
-
 
 @pytest.fixture
 async def user_token_headers(
@@ -180,22 +202,34 @@ def anyio_backend(request):
 
 
 @pytest.fixture
-async def client() -> AsyncGenerator:
+async def db() -> AsyncGenerator:
     """
-    Connect to MongoDB and yield AsyncClient until testing is complete. Tear
-    down database on end of tests
+    Start every test with an empty database, in memory or in MongoDB (see
+    `DB_BACKEND`). Tear down MongoDB on end of tests
     """
+    database.backend.use(DB_BACKEND)
+
+    if DB_BACKEND == "memory":
+        yield
+        return
+
     db_name = "pytest"
 
+    await utils.mongo.manager.connect(db_url=settings.DB_URL, db_name=db_name)
+    await utils.mongo.manager.init_beanie(db_name)
+
+    yield
+
+    await utils.mongo.manager.async_client.drop_database(db_name)
+    utils.mongo.manager.async_client.close()
+
+
+@pytest.fixture
+async def client(db) -> AsyncGenerator:
+    """
+    Yield AsyncClient until testing is complete
+    """
     async with AsyncClient(
         app=main.app, base_url="http://testserver"
     ) as client:
-        await utils.mongo.manager.connect(
-            db_url=settings.DB_URL, db_name=db_name
-        )
-        await utils.mongo.manager.init_beanie(db_name)
-
         yield client
-
-        await utils.mongo.manager.async_client.drop_database(db_name)
-        utils.mongo.manager.async_client.close()
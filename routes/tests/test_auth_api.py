@@ -1,6 +1,16 @@
+from fastapi import Request
 from httpx import AsyncClient
+import jwt
 import pytest
+from passlib.hash import bcrypt
+import auth.jwt
 import auth.security
+import auth.throttle
+from auth.revocation import revocations
+import database.backend
+import main
+from routes.tests.conftest import insert_user
+from utils.bloom import BloomFilter
 
 
 # Same as using the @pytest.mark.anyio on all test functions in the module
@@ -40,6 +50,21 @@ async def test_signup(client: AsyncClient, monkeypatch):
     assert response.status_code == 200
 
 
+async def test_signup_invalid_email(client: AsyncClient, monkeypatch):
+    hashed = []
+    monkeypatch.setattr(auth.security, "get_password_hash", hashed.append)
+
+    response = await client.post(
+        "auth/signup",
+        data={"username": "notanemail", "password": "randompassword"},
+    )
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["email"]
+    # Rejected before any hashing
+    assert hashed == []
+
+
 async def test_resignup(client: AsyncClient, test_user, monkeypatch):
     # Patch verify_password to skip password hashing (improves speed)
     monkeypatch.setattr(auth.security, "verify_password", verify_password_mock)
@@ -78,3 +103,156 @@ async def test_wrong_login(client: AsyncClient, test_user, test_password):
     )
 
     assert response.status_code == 401
+
+
+async def test_login_hashing_queue_full(
+    client: AsyncClient, test_user, monkeypatch
+):
+    monkeypatch.setattr(auth.security, "verify_password", verify_password_mock)
+    monkeypatch.setattr(auth.security.hasher, "capacity", 0)
+
+    response = await client.post(
+        "auth/token",
+        data={"username": test_user.email, "password": "nottheactualpass"},
+    )
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+async def test_token_cache(client: AsyncClient, user_token_headers):
+    await client.get("/users", headers=user_token_headers)
+    response = await client.get("/users", headers=user_token_headers)
+
+    assert response.status_code == 200
+    assert auth.jwt.token_cache.misses == 1
+    assert auth.jwt.token_cache.hits == 1
+
+
+async def test_logout(client: AsyncClient, user_token_headers):
+    response = await client.post("auth/logout", headers=user_token_headers)
+    assert response.status_code == 200
+
+    # Rebuild the filter from the database as the refresh task would
+    await revocations.refresh()
+
+    response = await client.get("/users", headers=user_token_headers)
+    assert response.status_code == 401
+
+
+async def test_revocations_loaded_at_startup(
+    client: AsyncClient, user_token_headers, monkeypatch
+):
+    response = await client.post("auth/logout", headers=user_token_headers)
+    assert response.status_code == 200
+
+    # A newly started worker, its filter is empty until loaded
+    monkeypatch.setattr(revocations, "filter", BloomFilter(1000))
+
+    await main.start_revocation_list()
+    await main.stop_revocation_list()
+
+    response = await client.get("/users", headers=user_token_headers)
+    assert response.status_code == 401
+
+
+async def test_revoke(
+    client: AsyncClient, user_token_headers, adminuser_token_headers
+):
+    token = user_token_headers["Authorization"].split(" ")[1]
+    jti = jwt.decode(token, options={"verify_signature": False})["jti"]
+
+    response = await client.post(
+        "auth/revoke", json={"jti": jti}, headers=adminuser_token_headers
+    )
+    assert response.status_code == 200
+
+    response = await client.get("/users", headers=user_token_headers)
+    assert response.status_code == 401
+
+
+async def test_revoke_unauthorized(client: AsyncClient, user_token_headers):
+    response = await client.post(
+        "auth/revoke", json={"jti": "anything"}, headers=user_token_headers
+    )
+    assert response.status_code == 403
+
+
+async def test_login_rehash(client: AsyncClient, monkeypatch):
+    def get_password_hash_mock(first: str):
+        return "rehashed"
+
+    monkeypatch.setattr(
+        auth.security, "get_password_hash", get_password_hash_mock
+    )
+
+    # A real hash made with a lower cost than configured
+    user = await insert_user(
+        email="oldhash@email.com",
+        hashed_password=bcrypt.using(rounds=4).hash("password"),
+    )
+
+    response = await client.post(
+        "auth/token", data={"username": user.email, "password": "password"}
+    )
+
+    assert response.status_code == 200
+    db_user = await database.backend.users.find_by_id(user.id)
+
+    assert db_user["hashed_password"] == "rehashed"
+
+
+async def test_login_throttled(client: AsyncClient, test_user, monkeypatch):
+    monkeypatch.setattr(auth.security, "verify_password", verify_password_mock)
+
+    for _ in range(auth.throttle.account_limiter.capacity):
+        response = await client.post(
+            "auth/token",
+            data={"username": test_user.email, "password": "password"},
+        )
+        assert response.status_code == 200
+
+    response = await client.post(
+        "auth/token",
+        data={"username": test_user.email, "password": "password"},
+    )
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+
+async def test_login_throttled_by_ip_keeps_account_attempts(
+    client: AsyncClient, test_user, monkeypatch
+):
+    monkeypatch.setattr(auth.security, "verify_password", verify_password_mock)
+
+    for _ in range(auth.throttle.ip_limiter.capacity):
+        auth.throttle.ip_limiter.acquire("127.0.0.1")
+
+    for _ in range(auth.throttle.account_limiter.capacity + 1):
+        response = await client.post(
+            "auth/token",
+            data={"username": test_user.email, "password": "password"},
+        )
+        assert response.status_code == 429
+
+    auth.throttle.ip_limiter.clear()
+
+    response = await client.post(
+        "auth/token",
+        data={"username": test_user.email, "password": "password"},
+    )
+
+    assert response.status_code == 200
+
+
+async def test_client_ip_missing():
+    request = Request({"type": "http", "client": None})
+
+    assert auth.throttle.client_ip(request) == "unknown"
+
+
+@pytest.mark.parametrize("capacity, per_minute", [(0, 5), (5, 0), (5, -1)])
+async def test_limiter_invalid_config(capacity, per_minute):
+    with pytest.raises(ValueError):
+        auth.throttle.TokenBucketLimiter(capacity, per_minute, 10)
@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+import boto3
+import pytest
+from moto.server import ThreadedMotoServer
+
+import utils.aws as aws
+
+
+# Same as using the @pytest.mark.anyio on all test functions in the module
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(scope="module")
+def s3_server():
+    """A local S3 stand-in"""
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server._server.server_address
+
+    yield f"http://{host}:{port}"
+
+    server.stop()
+
+
+@pytest.fixture
+def bucket(s3_server, monkeypatch):
+    """An S3 bucket with three files, used through the default settings"""
+    monkeypatch.setattr(aws.settings, "AWS_ENDPOINT_URL", s3_server)
+    monkeypatch.setattr(aws.settings, "AWS_KEY", "test")
+    monkeypatch.setattr(aws.settings, "AWS_SECRET", "test")
+
+    s3 = boto3.resource(
+        "s3",
+        endpoint_url=s3_server,
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+        region_name="us-east-1",
+    )
+    bucket = s3.create_bucket(Bucket="test-bucket")
+
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        bucket.put_object(Key=f"data/{name}", Body=name.encode())
+
+    yield "test-bucket/data"
+
+    bucket.objects.all().delete()
+    bucket.delete()
+
+
+async def test_download_files(bucket, tmp_path: Path):
+    progress = []
+
+    results = await aws.download_files(
+        [f"{bucket}/a.txt", f"{bucket}/b.txt", f"{bucket}/missing.txt"],
+        tmp_path,
+        concurrency=2,
+        progress=lambda result, done, total: progress.append((done, total)),
+    )
+
+    assert [result.ok for result in results] == [True, True, False]
+    assert results[0].path.read_bytes() == b"a.txt"
+    assert results[0].size == 5
+    assert results[2].attempts == 1
+    assert "FileNotFoundError" in results[2].error
+    assert sorted(progress) == [(1, 3), (2, 3), (3, 3)]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "a.txt",
+        "b.txt",
+    ]
+
+
+async def test_download_retries(bucket, tmp_path: Path, monkeypatch):
+    client = aws.init_new_client(asynchronous=True)
+    get_file = client._get_file
+    failures = [ConnectionResetError()]
+
+    async def flaky_get_file(rpath, lpath):
+        if failures:
+            raise failures.pop()
+
+        await get_file(rpath, lpath)
+
+    monkeypatch.setattr(client, "_get_file", flaky_get_file)
+
+    results = await aws.download_files(
+        [f"{bucket}/a.txt"], tmp_path, backoff=0, client=client
+    )
+    await (await client.set_session()).close()
+
+    assert results[0].ok
+    assert results[0].attempts == 2
+
+
+def test_download_file_list(bucket, tmp_path: Path):
+    downloaded, out_path = aws.download_file_list(
+        [f"{bucket}/a.txt", f"{bucket}/c.txt"],
+        tmp_path,
+        client=aws.init_new_client(),
+    )
+
+    assert out_path == tmp_path
+    assert downloaded == [tmp_path / "a.txt", tmp_path / "c.txt"]
+
+
+def test_download_by_date_modified(bucket, tmp_path: Path):
+    now = datetime.utcnow()
+    files = [f"{bucket}/a.txt", f"{bucket}/b.txt"]
+    client = aws.init_new_client()
+
+    downloaded, _ = aws.download_by_date_modified(
+        now - timedelta(hours=1), None, files, tmp_path, client=client
+    )
+    assert len(downloaded) == 2
+
+    downloaded, _ = aws.download_by_date_modified(
+        now + timedelta(hours=1), None, files, tmp_path, client=client
+    )
+    assert downloaded == []
+
+
+async def test_download_modified_lists_one_level(
+    bucket, s3_server, tmp_path: Path
+):
+    s3 = boto3.client(
+        "s3",
+        endpoint_url=s3_server,
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+        region_name="us-east-1",
+    )
+    s3.put_object(Bucket="test-bucket", Key="data/sub/d.txt", Body=b"d")
+
+    async with aws.connect() as client:
+        files = await aws.list_files(client, bucket, recursive=False)
+
+        # data/sub/d.txt is not listed
+        assert sorted(files) == [
+            f"{bucket}/a.txt",
+            f"{bucket}/b.txt",
+            f"{bucket}/c.txt",
+        ]
+
+        results = await aws.download_modified(
+            datetime.utcnow() - timedelta(hours=1),
+            None,
+            [f"{bucket}/a.txt", f"{bucket}/sub/d.txt"],
+            tmp_path,
+            client=client,
+        )
+
+    assert [result.ok for result in results] == [True, True]
+    assert (tmp_path / "d.txt").read_bytes() == b"d"
+
+
+async def test_sync_files(bucket, s3_server, tmp_path: Path):
+    s3 = boto3.client(
+        "s3",
+        endpoint_url=s3_server,
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+        region_name="us-east-1",
+    )
+    s3.put_object(Bucket="test-bucket", Key="data/sub/d.txt", Body=b"d")
+    (tmp_path / "local.txt").write_bytes(b"not synced")
+
+    result = await aws.sync_files(bucket, tmp_path)
+
+    assert len(result.downloaded) == 4
+    assert result.unchanged == 0
+    assert (tmp_path / "sub" / "d.txt").read_bytes() == b"d"
+
+    result = await aws.sync_files(bucket, tmp_path)
+
+    assert result.downloaded == []
+    assert result.unchanged == 4
+
+    s3.put_object(Bucket="test-bucket", Key="data/a.txt", Body=b"changed")
+    s3.delete_object(Bucket="test-bucket", Key="data/b.txt")
+
+    result = await aws.sync_files(bucket, tmp_path)
+
+    assert [r.aws_path for r in result.downloaded] == [
+        "test-bucket/data/a.txt"
+    ]
+    assert (tmp_path / "a.txt").read_bytes() == b"changed"
+    assert result.deleted == []
+    assert (tmp_path / "b.txt").exists()
+
+    result = aws.sync_directory(
+        bucket, tmp_path, delete=True, client=aws.init_new_client()
+    )
+
+    assert result.downloaded == []
+    assert result.deleted == [tmp_path / "b.txt"]
+    assert not (tmp_path / "b.txt").exists()
+    assert (tmp_path / "local.txt").exists()
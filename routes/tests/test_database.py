@@ -0,0 +1,96 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+from pymongo.read_preferences import ReadPreference, SecondaryPreferred
+
+import database.mongo
+import utils.mongo
+
+
+# Same as using the @pytest.mark.anyio on all test functions in the module
+pytestmark = pytest.mark.anyio
+
+
+def test_read_preference():
+    preference = database.mongo.read_preference("secondaryPreferred", 90)
+
+    assert isinstance(preference, SecondaryPreferred)
+    assert preference.max_staleness == 90
+
+    assert database.mongo.read_preference("primary") == ReadPreference.PRIMARY
+
+    with pytest.raises(ValueError):
+        database.mongo.read_preference("anywhere")
+
+
+async def test_primary_reads_without_session(monkeypatch):
+    monkeypatch.setattr(
+        database.mongo.settings, "DB_READ_PREFERENCE", "primary"
+    )
+    users = database.mongo.MongoUserRepository()
+
+    assert users.replicas is False
+
+    # Reads from the primary see every write without a session
+    async with users.session() as session:
+        assert session is None
+
+
+def test_replica_reads(monkeypatch):
+    monkeypatch.setattr(
+        database.mongo.settings, "DB_READ_PREFERENCE", "nearest"
+    )
+    monkeypatch.setattr(
+        database.mongo.settings, "DB_MAX_STALENESS_SECONDS", 120
+    )
+    users = database.mongo.MongoUserRepository()
+
+    assert users.replicas is True
+    assert users.read_preference.mongos_mode == "nearest"
+    assert users.read_preference.max_staleness == 120
+
+
+async def test_warm_waits_for_pool(monkeypatch):
+    manager = utils.mongo.MongoManager()
+    manager.pool_size = utils.mongo.PoolSize()
+    address = ("localhost", 27017)
+    pool = manager.pool_size
+
+    class Admin:
+        pings = 0
+
+        async def command(self, name):
+            self.pings += 1
+
+            if self.pings > 1:
+                return
+
+            # pymongo fills the pool in the background after the first use
+            async def fill():
+                pool.pool_ready(SimpleNamespace(address=address))
+
+                for id in range(3):
+                    await asyncio.sleep(0.01)
+                    pool.connection_ready(
+                        SimpleNamespace(address=address, connection_id=id)
+                    )
+
+            asyncio.get_running_loop().create_task(fill())
+
+    monkeypatch.setattr(
+        manager, "async_client", SimpleNamespace(admin=Admin()), raising=False
+    )
+
+    await manager.warm(3, 5)
+
+    assert pool.smallest() == 3
+
+    pool.connection_closed(SimpleNamespace(address=address, connection_id=0))
+    started = time.monotonic()
+
+    await manager.warm(3, 0.1)
+
+    # Gave up waiting for the closed connection to be replaced
+    assert pool.smallest() == 2
+    assert time.monotonic() - started < 1
@@ -0,0 +1,31 @@
+from httpx import AsyncClient
+import pytest
+
+import main
+from utils.startup import report
+
+
+# Same as using the @pytest.mark.anyio on all test functions in the module
+pytestmark = pytest.mark.anyio
+
+
+async def test_live(client: AsyncClient):
+    response = await client.get("/health/live")
+
+    assert response.status_code == 200
+
+
+async def test_ready(client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(report, "ready", False)
+
+    response = await client.get("/health/ready")
+    assert response.status_code == 503
+
+    await main.finish_startup()
+
+    response = await client.get("/health/ready")
+    assert response.status_code == 200
+
+    startup = response.json()["startup"]
+    assert "imports" in startup
+    assert "openapi" in startup
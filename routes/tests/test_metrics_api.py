@@ -0,0 +1,95 @@
+from datetime import timedelta
+from httpx import AsyncClient
+import pytest
+from pymongo import monitoring
+
+import routes.metrics
+import utils.query_log as query_log
+from utils.query_log import QUERY_COUNT_HEADER
+
+
+# Same as using the @pytest.mark.anyio on all test functions in the module
+pytestmark = pytest.mark.anyio
+
+
+async def test_metrics(
+    client: AsyncClient, test_user, superuser_token_headers
+):
+    response = await client.get(
+        f"/users/{test_user.id}", headers=superuser_token_headers
+    )
+    assert response.status_code == 200
+
+    response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/users/{id}",status="200"}'
+    ) in response.text
+    assert 'http_requests_in_flight{method="GET"} 1.0' in response.text
+    assert "password_hash_duration_seconds_count" in response.text
+    assert "jwt_verify_duration_seconds_count" in response.text
+
+
+async def test_metrics_token(client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(routes.metrics.settings, "METRICS_TOKEN", "secret")
+
+    response = await client.get("/metrics")
+    assert response.status_code == 401
+
+    response = await client.get(
+        "/metrics", headers={"Authorization": "Bearer secret"}
+    )
+    assert response.status_code == 200
+
+
+async def test_query_count_header(
+    client: AsyncClient, test_user, superuser_token_headers
+):
+    response = await client.get(
+        f"/users/{test_user.id}", headers=superuser_token_headers
+    )
+
+    assert response.status_code == 200
+    assert response.headers[QUERY_COUNT_HEADER].isdigit()
+
+
+def test_command_log(caplog, monkeypatch):
+    monkeypatch.setattr(query_log.settings, "SLOW_QUERY_MS", 50)
+
+    def run(request_id: int, command: dict, duration_ms: int):
+        query_log.command_log.started(
+            monitoring.CommandStartedEvent(
+                command, "pytest", request_id, ("localhost", 27017), None
+            )
+        )
+        query_log.command_log.succeeded(
+            monitoring.CommandSucceededEvent(
+                timedelta(milliseconds=duration_ms),
+                {"ok": 1},
+                next(iter(command)),
+                request_id,
+                ("localhost", 27017),
+                None,
+            )
+        )
+
+    request = query_log.RequestQueries("GET", "/users")
+    token = query_log.current_request.set(request)
+
+    try:
+        run(1, {"find": "user", "filter": {"email": "a@email.com"}}, 1)
+        run(2, {"find": "user", "filter": {"email": "a@email.com"}}, 80)
+        run(3, {"find": "user", "filter": {"email": "b@email.com"}}, 1)
+    finally:
+        query_log.current_request.reset(token)
+
+    assert request.count == 3
+    assert list(request.repeated().values()) == [2]
+
+    # Only the slow command is logged, without the filter's values
+    assert len(caplog.records) == 1
+    assert "find user {email: ?} took 80.0ms" in caplog.text
+    assert "a@email.com" not in caplog.text
@@ -0,0 +1,108 @@
+import pstats
+from httpx import AsyncClient
+import pytest
+
+import utils.profiling as profiling
+from utils.profiling import PROFILE_ID_HEADER
+
+
+# Same as using the @pytest.mark.anyio on all test functions in the module
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling.settings, "PROFILE_DIR", str(tmp_path))
+
+    return tmp_path
+
+
+async def test_profile_collapsed(
+    client: AsyncClient, test_user, superuser_token_headers
+):
+    response = await client.get(
+        f"/users/{test_user.id}",
+        headers={**superuser_token_headers, "X-Profile": "collapsed"},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["email"] == test_user.email
+
+    id = response.headers[PROFILE_ID_HEADER]
+
+    response = await client.get(
+        f"/profiles/{id}", headers=superuser_token_headers
+    )
+
+    assert response.status_code == 200
+
+    # Every line is a stack and its sample count
+    for line in response.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert count.isdigit()
+
+
+async def test_profile_pstats(
+    client: AsyncClient, test_user, superuser_token_headers, profile_dir
+):
+    response = await client.get(
+        f"/users/{test_user.id}",
+        headers={**superuser_token_headers, "X-Profile": "pstats"},
+    )
+
+    assert response.status_code == 200
+
+    id = response.headers[PROFILE_ID_HEADER]
+
+    response = await client.get(
+        f"/profiles/{id}", headers=superuser_token_headers
+    )
+
+    assert response.status_code == 200
+
+    path = profile_dir / "downloaded.pstats"
+    path.write_bytes(response.content)
+    functions = [key[2] for key in pstats.Stats(str(path)).stats]
+
+    assert "user_get" in functions
+
+
+async def test_profile_not_requested(
+    client: AsyncClient, test_user, superuser_token_headers
+):
+    response = await client.get(
+        f"/users/{test_user.id}", headers=superuser_token_headers
+    )
+
+    assert response.status_code == 200
+    assert PROFILE_ID_HEADER not in response.headers
+
+
+async def test_profile_unauthorized(
+    client: AsyncClient, test_user, adminuser_token_headers
+):
+    response = await client.get(
+        f"/users/{test_user.id}",
+        headers={**adminuser_token_headers, "X-Profile": "collapsed"},
+    )
+
+    assert response.status_code == 403
+    assert PROFILE_ID_HEADER not in response.headers
+
+    response = await client.get(
+        "/profiles/0123456789abcdef0123456789abcdef",
+        headers=adminuser_token_headers,
+    )
+
+    assert response.status_code == 403
+
+
+def test_save_profile_vanished_file(profile_dir, monkeypatch):
+    monkeypatch.setattr(profiling.settings, "PROFILE_KEEP", 1)
+
+    # Like a profile another worker deleted while this one was pruning
+    (profile_dir / "vanished.pstats").symlink_to(profile_dir / "missing")
+
+    profiling.save_profile("a" * 32, "collapsed", b"main 1\n")
+
+    assert profiling.find_profile("a" * 32) is not None
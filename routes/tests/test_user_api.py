@@ -1,8 +1,18 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
 import pytest
 from passlib.context import CryptContext
 from httpx import AsyncClient
 from beanie import PydanticObjectId
 
+import auth.security
+import config
+import database.backend
+import database.user
+from database.repository import Selection
 from models.user import User
 
 # Same as using the @pytest.mark.anyio on all test functions in the module
@@ -135,7 +145,7 @@ async def test_delete_user(
 
     assert response.status_code == 200
 
-    assert await User.find({}).to_list() == []
+    assert await database.backend.users.count() == 0
 
 
 async def test_delete_user_not_found(
@@ -225,3 +235,549 @@ async def test_unauthorized_routes(client: AsyncClient, user_token_headers):
 
     response = await client.get("/users/123", headers=user_token_headers)
     assert response.status_code == 403
+
+
+async def test_deactivated_user_cache_invalidated(
+    client: AsyncClient,
+    test_user: User,
+    user_token_headers,
+    superuser_token_headers,
+):
+    response = await client.get("/users", headers=user_token_headers)
+    assert response.status_code == 200
+
+    response = await client.put(
+        f"/users/{test_user.id}",
+        json={"email": test_user.email, "is_active": False},
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 200
+    assert test_user.id not in database.user.principal_emails
+
+    response = await client.get("/users", headers=user_token_headers)
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def claims_only_auth(monkeypatch):
+    monkeypatch.setattr(config.get_settings(), "CLAIMS_ONLY_AUTH", True)
+
+
+async def test_claims_only_auth(
+    client: AsyncClient,
+    test_user: User,
+    claims_only_auth,
+    test_adminuser: User,
+    adminuser_token_headers,
+):
+    # The admin is gone from the database but their token's claims are
+    # still trusted for reads until it expires
+    await database.backend.users.delete(test_adminuser.id)
+
+    response = await client.get(
+        f"/users/{test_user.id}", headers=adminuser_token_headers
+    )
+    assert response.status_code == 200
+
+    # Privileged writes always check the database
+    response = await client.delete(
+        f"/users/{test_user.id}", headers=adminuser_token_headers
+    )
+    assert response.status_code == 403
+
+
+async def test_claims_only_bulk_after_demotion(
+    client: AsyncClient,
+    test_user: User,
+    claims_only_auth,
+    test_superuser: User,
+    superuser_token_headers,
+):
+    # The token still claims superuser but the database no longer does
+    await database.backend.users.update(
+        test_superuser.id, {"is_super_user": False}
+    )
+
+    response = await client.post(
+        "/users/bulk/",
+        json={
+            "action": "set_role",
+            "role": "super",
+            "ids": [str(test_user.id)],
+        },
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 403
+
+    user = await database.backend.users.find_by_id(test_user.id)
+    assert not user["is_super_user"]
+
+
+async def test_users_list_pages(
+    client: AsyncClient,
+    test_user: User,
+    test_adminuser: User,
+    test_superuser: User,
+    superuser_token_headers,
+):
+    response = await client.get(
+        "/users/get-all/?limit=2", headers=superuser_token_headers
+    )
+
+    assert response.status_code == 200
+    assert [user["_id"] for user in response.json()] == [
+        str(test_user.id),
+        str(test_adminuser.id),
+    ]
+    assert response.headers["Content-Range"] == "users 0-1/3"
+    assert "X-Prev-Cursor" not in response.headers
+
+    after = response.headers["X-Next-Cursor"]
+
+    response = await client.get(
+        f"/users/get-all/?limit=2&start=2&after={after}",
+        headers=superuser_token_headers,
+    )
+
+    assert [user["_id"] for user in response.json()] == [
+        str(test_superuser.id)
+    ]
+    assert response.headers["Content-Range"] == "users 2-2/3"
+    assert "X-Next-Cursor" not in response.headers
+
+    before = response.headers["X-Prev-Cursor"]
+
+    response = await client.get(
+        f"/users/get-all/?limit=2&before={before}",
+        headers=superuser_token_headers,
+    )
+
+    assert [user["_id"] for user in response.json()] == [
+        str(test_user.id),
+        str(test_adminuser.id),
+    ]
+
+
+async def test_users_export(
+    client: AsyncClient,
+    test_user: User,
+    test_superuser: User,
+    superuser_token_headers,
+):
+    response = await client.get(
+        "/users/export/", headers=superuser_token_headers
+    )
+
+    assert response.status_code == 200
+    assert [json.loads(line)["_id"] for line in response.iter_lines()] == [
+        str(test_user.id),
+        str(test_superuser.id),
+    ]
+
+    response = await client.get(
+        "/users/export/?format=csv&gzip=true", headers=superuser_token_headers
+    )
+
+    assert response.status_code == 200
+
+    rows = list(
+        csv.DictReader(io.StringIO(gzip.decompress(response.content).decode()))
+    )
+
+    assert [row["email"] for row in rows] == [
+        test_user.email,
+        test_superuser.email,
+    ]
+    assert "hashed_password" not in rows[0]
+
+
+async def test_users_export_unauthorized(
+    client: AsyncClient, adminuser_token_headers
+):
+    response = await client.get(
+        "/users/export/", headers=adminuser_token_headers
+    )
+    assert response.status_code == 403
+
+
+async def test_edit_user_partial(
+    client: AsyncClient, test_user: User, superuser_token_headers
+):
+    response = await client.put(
+        f"/users/{test_user.id}",
+        json={"email": test_user.email, "first_name": "Edited"},
+        headers=superuser_token_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json()["first_name"] == "Edited"
+    assert response.json()["is_admin_user"] == test_user.is_admin_user
+
+    db_user = await database.backend.users.find_by_id(test_user.id)
+
+    assert db_user["first_name"] == "Edited"
+    assert db_user["hashed_password"] == test_user.hashed_password
+
+
+async def test_create_user_exists(
+    client: AsyncClient,
+    test_password,
+    test_user: User,
+    adminuser_token_headers,
+):
+    response = await client.post(
+        "/users",
+        json={"email": test_user.email, "password": test_password},
+        headers=adminuser_token_headers,
+    )
+
+    assert response.status_code == 409
+
+
+def get_password_hash_mock(password: str):
+    return "securepasswordsecrethash"
+
+
+async def test_import_users(
+    client: AsyncClient,
+    test_password,
+    test_user: User,
+    adminuser_token_headers,
+    monkeypatch,
+):
+    # Patch get_password_hash to skip password hashing (improves speed)
+    monkeypatch.setattr(
+        auth.security, "get_password_hash", get_password_hash_mock
+    )
+
+    response = await client.post(
+        "/users/import/",
+        json=[
+            {"email": "imported@email.com", "password": test_password},
+            {"email": test_user.email, "password": test_password},
+            {"email": "notanemail", "password": test_password},
+        ],
+        headers=adminuser_token_headers,
+    )
+
+    assert response.status_code == 200
+
+    report = response.json()
+
+    assert report["created"] == 1
+    assert report["failed"] == 2
+    assert [result["index"] for result in report["results"]] == [0, 1, 2]
+    assert report["results"][1]["error"] == "User already exists"
+    assert report["results"][2]["error"].startswith("email")
+
+    db_user = await database.backend.users.find_by_id(
+        PydanticObjectId(report["results"][0]["id"])
+    )
+
+    assert db_user["email"] == "imported@email.com"
+    assert db_user["is_admin_user"] is False
+
+
+async def test_import_users_ndjson(
+    client: AsyncClient, adminuser_token_headers, monkeypatch
+):
+    monkeypatch.setattr(
+        auth.security, "get_password_hash", get_password_hash_mock
+    )
+
+    lines = [
+        json.dumps({"email": f"user{index}@email.com", "password": "secret"})
+        for index in range(3)
+    ]
+
+    response = await client.post(
+        "/users/import/",
+        content="\n".join(lines + ["not json"]),
+        headers={
+            **adminuser_token_headers,
+            "Content-Type": "application/x-ndjson",
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.json()["created"] == 3
+    assert response.json()["failed"] == 1
+
+
+async def test_import_users_ndjson_streamed(
+    client: AsyncClient, adminuser_token_headers, monkeypatch
+):
+    monkeypatch.setattr(
+        auth.security, "get_password_hash", get_password_hash_mock
+    )
+    monkeypatch.setattr(config.get_settings(), "IMPORT_BATCH_SIZE", 2)
+
+    body = "".join(
+        json.dumps({"email": f"user{index}@email.com", "password": "secret"})
+        + "\n"
+        for index in range(5)
+    ).encode()
+
+    async def chunks():
+        # Split records across chunks
+        for position in range(0, len(body), 7):
+            yield body[position : position + 7]
+
+    response = await client.post(
+        "/users/import/",
+        content=chunks(),
+        headers={
+            **adminuser_token_headers,
+            "Content-Type": "application/x-ndjson",
+        },
+    )
+
+    assert response.status_code == 200
+
+    report = response.json()
+
+    assert report["created"] == 5
+    assert [result["index"] for result in report["results"]] == [0, 1, 2, 3, 4]
+    assert report["results"][4]["email"] == "user4@email.com"
+
+
+async def test_import_users_too_large(
+    client: AsyncClient, adminuser_token_headers, monkeypatch
+):
+    monkeypatch.setattr(config.get_settings(), "IMPORT_MAX_BODY_BYTES", 10)
+
+    response = await client.post(
+        "/users/import/",
+        json=[{"email": "imported@email.com", "password": "secret"}],
+        headers=adminuser_token_headers,
+    )
+
+    assert response.status_code == 413
+
+
+async def test_import_hashing_leaves_room_for_logins(monkeypatch):
+    running = []
+    jobs = []
+
+    async def run(fn, *args):
+        running.append(args)
+        jobs.append(len(running))
+        await asyncio.sleep(0)
+        running.remove(args)
+
+        return fn(*args)
+
+    monkeypatch.setattr(auth.security.hasher, "run", run)
+    monkeypatch.setattr(
+        auth.security, "get_password_hash", get_password_hash_mock
+    )
+
+    # No process is started, jobs never reach the pool
+    auth.security.hasher.start(3, 64)
+
+    try:
+        # Two imports at once
+        hashes, _ = await asyncio.gather(
+            auth.security.get_password_hashes_async(["secret"] * 10),
+            auth.security.get_password_hashes_async(["secret"] * 10),
+        )
+    finally:
+        auth.security.hasher.close()
+
+    assert len(hashes) == 10
+    # One password per job, one process always free for logins
+    assert len(jobs) == 20
+    assert max(jobs) == 2
+
+
+async def test_import_users_hashing_fails(
+    client: AsyncClient, adminuser_token_headers, monkeypatch
+):
+    monkeypatch.setattr(
+        auth.security, "get_password_hash", get_password_hash_mock
+    )
+    monkeypatch.setattr(config.get_settings(), "IMPORT_BATCH_SIZE", 1)
+    get_password_hashes_async = auth.security.get_password_hashes_async
+    calls = []
+
+    async def busy_after_first_batch(passwords):
+        calls.append(passwords)
+
+        if len(calls) > 1:
+            raise auth.security.HashQueueFull()
+
+        return await get_password_hashes_async(passwords)
+
+    monkeypatch.setattr(
+        auth.security, "get_password_hashes_async", busy_after_first_batch
+    )
+
+    response = await client.post(
+        "/users/import/",
+        json=[
+            {"email": "first@email.com", "password": "secret"},
+            {"email": "second@email.com", "password": "secret"},
+        ],
+        headers=adminuser_token_headers,
+    )
+
+    assert response.status_code == 200
+
+    report = response.json()
+
+    assert report["created"] == 1
+    assert report["results"][0]["id"] is not None
+    assert report["results"][1]["error"] == "Server is busy, please try again"
+
+
+async def test_import_users_ndjson_line_too_long(
+    client: AsyncClient, adminuser_token_headers, monkeypatch
+):
+    monkeypatch.setattr(
+        auth.security, "get_password_hash", get_password_hash_mock
+    )
+    monkeypatch.setattr(config.get_settings(), "IMPORT_MAX_LINE_BYTES", 100)
+
+    record = json.dumps({"email": "user@email.com", "password": "secret"})
+
+    async def chunks():
+        yield b'{"email": "' + b"a" * 60
+        yield b"a" * 60
+        yield b'@email.com", "password": "secret"}\n' + record.encode()
+
+    response = await client.post(
+        "/users/import/",
+        content=chunks(),
+        headers={
+            **adminuser_token_headers,
+            "Content-Type": "application/x-ndjson",
+        },
+    )
+
+    assert response.status_code == 200
+
+    report = response.json()
+
+    assert report["created"] == 1
+    assert report["results"][0]["error"] is not None
+    assert report["results"][1]["email"] == "user@email.com"
+
+
+async def test_bulk_users(
+    client: AsyncClient,
+    test_user: User,
+    test_adminuser: User,
+    test_superuser: User,
+    superuser_token_headers,
+):
+    response = await client.post(
+        "/users/bulk/",
+        json={
+            "action": "deactivate",
+            "ids": [str(test_user.id), str(test_adminuser.id)],
+        },
+        headers=superuser_token_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"matched": 2, "modified": 2}
+    assert (await database.backend.users.find_by_id(test_user.id))[
+        "is_active"
+    ] is False
+
+    response = await client.post(
+        "/users/bulk/",
+        json={
+            "action": "set_role",
+            "role": "admin",
+            "email_domain": "email.com",
+        },
+        headers=superuser_token_headers,
+    )
+
+    assert response.json() == {"matched": 2, "modified": 1}
+    assert (await database.backend.users.find_by_id(test_user.id))[
+        "is_admin_user"
+    ] is True
+    assert (await database.backend.users.find_by_id(test_superuser.id))[
+        "is_super_user"
+    ] is True
+
+    response = await client.post(
+        "/users/bulk/",
+        json={"action": "delete", "ids": [str(test_user.id)]},
+        headers=superuser_token_headers,
+    )
+
+    assert response.json() == {"matched": 1, "modified": 1}
+    assert await database.backend.users.find_by_id(test_user.id) is None
+
+
+async def test_bulk_users_requires_selection(
+    client: AsyncClient, superuser_token_headers
+):
+    response = await client.post(
+        "/users/bulk/",
+        json={"action": "delete"},
+        headers=superuser_token_headers,
+    )
+
+    assert response.status_code == 422
+
+
+async def test_bulk_users_empty_email_domain(
+    client: AsyncClient, test_user: User, superuser_token_headers
+):
+    for email_domain in ("@", " ", ""):
+        response = await client.post(
+            "/users/bulk/",
+            json={"action": "delete", "email_domain": email_domain},
+            headers=superuser_token_headers,
+        )
+
+        assert response.status_code == 422
+
+    assert await database.backend.users.find_by_id(test_user.id) is not None
+
+    response = await client.post(
+        "/users/bulk/",
+        json={"action": "deactivate", "email_domain": " @Email.COM"},
+        headers=superuser_token_headers,
+    )
+
+    assert response.status_code == 200
+    assert (await database.backend.users.find_by_id(test_user.id))[
+        "is_active"
+    ] is False
+
+
+async def test_bulk_users_selection_checked():
+    with pytest.raises(ValueError):
+        await database.backend.users.delete_many(Selection())
+
+
+async def test_fast_responses(
+    client: AsyncClient,
+    test_user: User,
+    test_superuser: User,
+    superuser_token_headers,
+    monkeypatch,
+):
+    responses = {}
+
+    for fast in (False, True):
+        monkeypatch.setattr(config.get_settings(), "FAST_RESPONSES", fast)
+
+        responses[fast] = [
+            await client.get(url, headers=superuser_token_headers)
+            for url in ("/users", f"/users/{test_user.id}", "/users/get-all/")
+        ]
+
+    for default, fast in zip(responses[False], responses[True]):
+        assert fast.status_code == 200
+        assert fast.json() == default.json()
+
+    assert (
+        responses[True][2].headers["Content-Range"]
+        == responses[False][2].headers["Content-Range"]
+    )
@@ -1,12 +1,45 @@
-from typing import List
-from fastapi import APIRouter, Body, Depends, Response
+import json
+from typing import List, Literal
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
 
+from fastapi.responses import StreamingResponse
 from beanie import PydanticObjectId
 
+import config
 import database.user as db
 import models.user as models
 
 import auth.jwt as auth
+import utils.stream as stream
+from utils.response import FastJSONResponse
+
+settings = config.get_settings()
+
+
+def respond(content, headers: dict = None):
+    """
+    Return user content from a route. With `FAST_RESPONSES` enabled it is
+    encoded with orjson straight away instead of being validated against
+    the route's response model
+
+    Args:
+        - `content`: `UserOut` shaped models
+        - `headers`: Extra response headers
+    """
+    if settings.FAST_RESPONSES:
+        return FastJSONResponse(content, headers=headers)
+
+    return content
+
 
 r = APIRouter(
     tags=["User Routes"],
@@ -20,7 +53,14 @@ async def user_me(current_user=Depends(auth.get_active_user)):
     """
     Get current user from JWT
     """
-    return current_user
+    user = await db.get_principal(current_user.email)
+
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+
+    return respond(user)
 
 
 @r.get("/{id}", response_model=models.UserOut)
@@ -33,13 +73,13 @@ async def user_get(
     Args:
        - `id`: The MongoDB id of the user
     """
-    return await db.get_user(id)
+    return respond(await db.get_user(id))
 
 
 @r.post("", response_model=models.UserOut)
 async def user_create(
     create: models.UserCreate = Body(),
-    admin=Depends(auth.get_current_active_admin),
+    admin=Depends(auth.get_current_active_admin_from_db),
 ):
     """
     Create a new user in the database
@@ -52,8 +92,75 @@ async def user_create(
     return user
 
 
+@r.post("/import/", response_model=models.UserImportReport)
+async def user_import(
+    request: Request,
+    admin=Depends(auth.get_current_active_admin_from_db),
+):
+    """
+    Create users in bulk. The body is a JSON array of users to create, of
+    at most `IMPORT_MAX_BODY_BYTES`, or newline delimited JSON of any size
+    when sent as `application/x-ndjson`, which is read a batch at a time.
+    Returns a result for every record
+
+    Args:
+       - `request`: The request containing the users
+    """
+    content_type = request.headers.get("content-type", "")
+
+    if content_type.startswith("application/x-ndjson"):
+        records = stream.parse_ndjson(
+            request.stream(), settings.IMPORT_MAX_LINE_BYTES
+        )
+    else:
+        body = bytearray()
+
+        async for chunk in request.stream():
+            body += chunk
+
+            if len(body) > settings.IMPORT_MAX_BODY_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail="Too many users, send them as application/x-ndjson",
+                )
+
+        try:
+            records = json.loads(body)
+        except ValueError:
+            records = None
+
+        if not isinstance(records, list):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Expected a JSON array of users",
+            )
+
+    return await db.import_users(records, settings.IMPORT_BATCH_SIZE)
+
+
+@r.post("/bulk/", response_model=models.UserBulkResult)
+async def user_bulk(
+    action: models.UserBulkAction = Body(),
+    superuser=Depends(auth.get_current_active_superuser_from_db),
+):
+    """
+    Deactivate, activate, change the role of, or delete users selected by ID
+    and/or email domain. The current user is never changed
+
+    Args:
+       - `action`: The operation and the users to apply it to
+    """
+    return await db.bulk_action(
+        action, superuser.id, settings.BULK_ID_BATCH_SIZE
+    )
+
+
 @r.put("/{id}", response_model=models.UserOut)
-async def user_edit(id: PydanticObjectId, edit: models.UserEdit):
+async def user_edit(
+    id: PydanticObjectId,
+    edit: models.UserEdit,
+    admin=Depends(auth.get_current_active_admin_from_db),
+):
     """
     Edit a user in the database
 
@@ -68,7 +175,9 @@ async def user_edit(id: PydanticObjectId, edit: models.UserEdit):
 
 
 @r.delete("/{id}", response_model=bool)
-async def user_delete(id: PydanticObjectId):
+async def user_delete(
+    id: PydanticObjectId, admin=Depends(auth.get_current_active_admin_from_db)
+):
     """
     Delete a user in the database
 
@@ -83,18 +192,84 @@ async def user_delete(id: PydanticObjectId):
 @r.get("/get-all/", response_model=List[models.UserOut])
 async def user_list(
     response: Response,
-    limit=100,
+    limit: int = Query(100, gt=0),
+    after: str = None,
+    before: str = None,
+    sort: Literal["_id", "email"] = "_id",
+    order: Literal["asc", "desc"] = "asc",
+    start: int = Query(0, ge=0),
     superuser=Depends(auth.get_current_active_superuser),
 ):
     """
-    Get all users
+    Get a page of users. Follow the `X-Next-Cursor` and `X-Prev-Cursor`
+    response headers with `after` and `before` to move between pages
 
     Args:
-       - `limit`: List size limit
+       - `limit`: Page size (capped at `USERS_PAGE_SIZE_MAX`)
+       - `after`: Get the page after this cursor
+       - `before`: Get the page before this cursor
+       - `sort`: Field to sort by
+       - `order`: Sort order
+       - `start`: Position of the page's first user, reported in
+         `Content-Range`
     """
-    users = await db.get_users(limit)
+    limit = min(limit, settings.USERS_PAGE_SIZE_MAX)
+
+    users, next_cursor, previous_cursor = await db.get_users(
+        limit, after, before, sort, order
+    )
+    total = await db.count_users()
 
     # This is necessary for react-admin to work
-    response.headers["Content-Range"] = f"0-9/{len(users)}"
+    if users:
+        end = start + len(users) - 1
+        headers = {"Content-Range": f"users {start}-{end}/{total}"}
+    else:
+        headers = {"Content-Range": f"users */{total}"}
+
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+
+    if previous_cursor is not None:
+        headers["X-Prev-Cursor"] = previous_cursor
+
+    response.headers.update(headers)
+
+    return respond(users, headers)
+
+
+@r.get("/export/")
+async def user_export(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+    superuser=Depends(auth.get_current_active_superuser),
+):
+    """
+    Stream every user as newline delimited JSON or CSV
+
+    Args:
+       - `format`: Export format
+       - `gzip`: Compress the export
+    """
+    users = db.iter_users(settings.EXPORT_BATCH_SIZE)
+
+    if format == "csv":
+        fields = [field.alias for field in models.UserOut.__fields__.values()]
+        chunks = stream.csv_chunks(users, fields)
+        media_type = "text/csv"
+    else:
+        chunks = stream.ndjson_chunks(users)
+        media_type = "application/x-ndjson"
+
+    filename = f"users.{format}"
+
+    if gzip:
+        chunks = stream.gzip_chunks(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
 
-    return users
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
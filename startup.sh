@@ -1 +1,3 @@
-gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app --timeout 600
\ No newline at end of file
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+gunicorn -c gunicorn.conf.py -w 4 -k uvicorn.workers.UvicornWorker main:app --timeout 600
@@ -1,12 +1,26 @@
+import asyncio
+import json
 import logging
 import os
+import random
 import pytz
+from contextlib import asynccontextmanager
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import List
-from threading import Thread
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
 from aiobotocore.session import AioSession
+from fsspec.asyn import sync
 from s3fs import S3FileSystem
 
 import config
@@ -16,29 +30,495 @@ logger = logging.getLogger("uvicorn.error")
 settings = config.get_settings()
 
 
-def init_new_client():
-    """Initiate a S3FS connection"""
+class DownloadResult(NamedTuple):
+    """The outcome of downloading one AWS file"""
+
+    aws_path: str
+    """File path on AWS"""
+    path: Optional[Path] = None
+    """Where the file was downloaded to, None if it failed"""
+    size: int = 0
+    """Bytes downloaded"""
+    attempts: int = 0
+    """Number of tries, 1 if the first one succeeded"""
+    error: Optional[str] = None
+    """Why the download failed"""
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+Progress = Callable[[DownloadResult, int, int], Any]
+"""Called with each result, the number of files done and the total"""
+
+NOT_RETRYABLE = (FileNotFoundError, PermissionError)
+"""Errors a download won't recover from by trying again"""
+
+MANIFEST = ".s3-manifest.json"
+"""File in a download directory recording what was synced into it"""
+
+
+def init_new_client(asynchronous: bool = False):
+    """
+    Initiate a S3FS connection
+
+    Args:
+        - `asynchronous`: Make a connection for the running event loop, for
+          the async methods only. It must be closed with
+          `await (await client.set_session()).close()`
+    """
     session = AioSession()
+    client_kwargs = {}
+
+    if settings.AWS_ENDPOINT_URL:
+        client_kwargs["endpoint_url"] = settings.AWS_ENDPOINT_URL
 
     return S3FileSystem(
         session=session,
         key=settings.AWS_KEY,
         secret=settings.AWS_SECRET,
+        client_kwargs=client_kwargs,
         default_block_size=55 * 1024 * 1024,  # Max file size: 55 MB
+        asynchronous=asynchronous,
+        # A cached connection may belong to another event loop
+        skip_instance_cache=asynchronous,
+    )
+
+
+@lru_cache
+def get_client():
+    """
+    Get the shared S3FS connection, created on first use rather than when
+    this module is imported
+    """
+    return init_new_client()
+
+
+async def map_limited(
+    fn: Callable[[Any], Awaitable[Any]], items: List[Any], concurrency: int
+):
+    """
+    Run a coroutine function on every item, at most `concurrency` at once.
+    Returns the results in the order of the items
+
+    Args:
+        - `fn`: The coroutine function
+        - `items`: The items
+        - `concurrency`: Most items processed at once
+    """
+    results: List[Any] = [None] * len(items)
+    indexes = iter(range(len(items)))
+
+    async def worker():
+        for index in indexes:
+            results[index] = await fn(items[index])
+
+    await asyncio.gather(
+        *(worker() for _ in range(min(max(1, concurrency), len(items))))
+    )
+
+    return results
+
+
+@asynccontextmanager
+async def connect(client: S3FileSystem = None):
+    """
+    Get a connected S3FS connection for the async methods
+
+    Args:
+        - `client`: Connection to use (default: a new connection, closed
+          afterwards)
+    """
+    if client is not None:
+        await client.set_session()
+        yield client
+        return
+
+    client = init_new_client(asynchronous=True)
+    session = await client.set_session()
+
+    try:
+        yield client
+    finally:
+        await session.close()
+
+
+async def download_with_retries(
+    client: S3FileSystem,
+    aws_path: str,
+    destination: Path,
+    retries: int,
+    backoff: float,
+):
+    """
+    Download an AWS file, trying again after a growing random delay when it
+    fails. The file is written next to its destination and moved into place
+    once complete, so a failed download never leaves a partial file
+
+    Args:
+        - `client`: S3FS connection
+        - `aws_path`: File path on AWS
+        - `destination`: Where to write the file
+        - `retries`: Times to try again
+        - `backoff`: Most seconds before the first retry, doubled each time
+    """
+    name = destination.name
+    partial = destination.with_name(f"{name}.part")
+    attempts = 0
+
+    destination.parent.mkdir(parents=True, exist_ok=True)
+
+    while True:
+        attempts += 1
+
+        try:
+            await client._get_file(aws_path, str(partial))
+            os.replace(partial, destination)
+        except Exception as error:
+            partial.unlink(missing_ok=True)
+
+            if isinstance(error, NOT_RETRYABLE) or attempts > retries:
+                logger.warning(f"{name} - failed: {error!r}")
+
+                return DownloadResult(
+                    aws_path, attempts=attempts, error=repr(error)
+                )
+
+            await asyncio.sleep(
+                random.uniform(0, backoff * 2 ** (attempts - 1))
+            )
+            continue
+
+        logger.info(f"{name} - downloaded")
+
+        return DownloadResult(
+            aws_path, destination, destination.stat().st_size, attempts
+        )
+
+
+async def download_all(
+    client: S3FileSystem,
+    files: List[Tuple[str, Path]],
+    concurrency: int = None,
+    retries: int = None,
+    backoff: float = None,
+    progress: Progress = None,
+) -> List[DownloadResult]:
+    """
+    Download AWS files a few at a time. Returns a result for every file, in
+    the order of `files`
+
+    Args:
+        - `client`: S3FS connection
+        - `files`: File paths on AWS and where to write them
+        - `concurrency`: Most files downloaded at once (default:
+          `S3_DOWNLOAD_CONCURRENCY`)
+        - `retries`: Times a failed download is retried (default:
+          `S3_DOWNLOAD_RETRIES`)
+        - `backoff`: Most seconds before the first retry, doubled each time
+          (default: `S3_DOWNLOAD_BACKOFF`)
+        - `progress`: Called after each file with its result, the number of
+          files done and the total
+    """
+    concurrency = concurrency or settings.S3_DOWNLOAD_CONCURRENCY
+    retries = settings.S3_DOWNLOAD_RETRIES if retries is None else retries
+    backoff = settings.S3_DOWNLOAD_BACKOFF if backoff is None else backoff
+    done = 0
+
+    async def download(file: Tuple[str, Path]):
+        nonlocal done
+
+        result = await download_with_retries(client, *file, retries, backoff)
+        done += 1
+
+        if progress is not None:
+            progress(result, done, len(files))
+
+        return result
+
+    return await map_limited(download, files, concurrency)
+
+
+async def download_files(
+    aws_paths: List[str],
+    out_path: Path,
+    client: S3FileSystem = None,
+    **kwargs,
+) -> List[DownloadResult]:
+    """
+    Download AWS files without blocking the event loop, a few at a time.
+    A file that fails doesn't stop the others. Returns a result for every
+    file, in the order of `aws_paths`
+
+    Args:
+        - `aws_paths`: File paths on AWS
+        - `out_path`: Download directory
+        - `client`: S3FS connection (default: a new connection, closed
+          afterwards)
+        - `kwargs`: `concurrency`, `retries`, `backoff` and `progress` (see
+          `download_all`)
+    """
+    files = [
+        (aws_path, Path(out_path) / os.path.basename(aws_path))
+        for aws_path in aws_paths
+    ]
+
+    async with connect(client) as client:
+        return await download_all(client, files, **kwargs)
+
+
+def as_utc(moment: datetime) -> datetime:
+    """
+    Get a datetime as timezone aware UTC
+
+    Args:
+        - `moment`: A naive UTC or timezone aware datetime
+    """
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=pytz.utc)
+
+    return moment.astimezone(pytz.utc)
+
+
+async def list_files(
+    client: S3FileSystem, aws_path: str, recursive: bool = True
+) -> Dict[str, dict]:
+    """
+    Get every file under an AWS path with its `size`, `ETag` and
+    `LastModified` from one paginated listing, keyed by file path on AWS
+
+    Args:
+        - `client`: S3FS connection
+        - `aws_path`: Directory path on AWS
+        - `recursive`: Include files in subdirectories, otherwise only the
+          directory's own files are listed
+    """
+    listing = await client._lsdir(
+        client._strip_protocol(aws_path).rstrip("/"),
+        refresh=True,
+        delimiter="" if recursive else "/",
     )
 
+    return {
+        info["name"]: info
+        for info in listing
+        if info["type"] == "file" and not info["name"].endswith("/")
+    }
+
+
+async def download_modified(
+    start_date: datetime,
+    stop_date: Optional[datetime],
+    aws_paths: List[str],
+    out_path: Path,
+    client: S3FileSystem = None,
+    **kwargs,
+) -> List[DownloadResult]:
+    """
+    Download the AWS files modified after `start_date` and before
+    `stop_date`, without blocking the event loop. Modified dates come from
+    listing each directory once rather than a request per file
+
+    Args:
+        - `start_date`: Start date for processing
+        - `stop_date`: End date for processing, None for no end
+        - `aws_paths`: File paths on AWS
+        - `out_path`: Download directory
+        - `client`: S3FS connection (default: a new connection, closed
+          afterwards)
+        - `kwargs`: Options of `download_all`
+    """
+    start_date = as_utc(start_date)
+    stop_date = None if stop_date is None else as_utc(stop_date)
+
+    async with connect(client) as client:
+        paths = [client._strip_protocol(path) for path in aws_paths]
+        files: Dict[str, dict] = {}
+
+        for directory in dict.fromkeys(os.path.dirname(p) for p in paths):
+            files.update(await list_files(client, directory, recursive=False))
+
+        selected: List[str] = []
+
+        for path in paths:
+            if path not in files:
+                logger.warning(f"{os.path.basename(path)} - not found")
+                continue
+
+            last_modified = as_utc(files[path]["LastModified"])
+
+            if last_modified > start_date and (
+                stop_date is None or last_modified < stop_date
+            ):
+                selected.append(path)
+            else:
+                logger.warning(f"{last_modified} - out of range")
+
+        return await download_all(
+            client,
+            [
+                (path, Path(out_path) / os.path.basename(path))
+                for path in selected
+            ],
+            **kwargs,
+        )
+
+
+class SyncResult(NamedTuple):
+    """What a sync changed"""
+
+    downloaded: List[DownloadResult]
+    """Results of the new and changed files"""
+    unchanged: int
+    """Number of files already up to date"""
+    deleted: List[Path]
+    """Local files removed because they were removed from AWS"""
+
+
+def read_manifest(out_path: Path, aws_path: str) -> Dict[str, dict]:
+    """
+    Get the files recorded by the last sync of an AWS directory, keyed by
+    path relative to the directory. Empty if it was never synced
+
+    Args:
+        - `out_path`: Download directory
+        - `aws_path`: Directory path on AWS
+    """
+    try:
+        manifest = json.loads((Path(out_path) / MANIFEST).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+    if manifest.get("aws_path") != aws_path:
+        return {}
+
+    return manifest.get("files", {})
+
+
+def write_manifest(out_path: Path, aws_path: str, files: Dict[str, dict]):
+    """
+    Record the files synced from an AWS directory
+
+    Args:
+        - `out_path`: Download directory
+        - `aws_path`: Directory path on AWS
+        - `files`: `size`, `etag` and `last_modified` of each file, keyed by
+          path relative to the directory
+    """
+    path = Path(out_path) / MANIFEST
+    partial = path.with_name(f"{MANIFEST}.part")
+
+    partial.write_text(json.dumps({"aws_path": aws_path, "files": files}))
+    os.replace(partial, path)
+
+
+async def sync_files(
+    aws_path: str,
+    out_path: Path,
+    delete: bool = False,
+    client: S3FileSystem = None,
+    **kwargs,
+) -> SyncResult:
+    """
+    Make a download directory match an AWS directory, downloading only the
+    files that are new or changed since the last sync. Sizes and ETags come
+    from one paginated listing and are compared with a manifest kept in the
+    download directory. Files that fail are tried again on the next sync
+
+    Args:
+        - `aws_path`: Directory path on AWS
+        - `out_path`: Download directory
+        - `delete`: Remove local files that were synced before and have
+          since been removed from AWS. Other local files are left alone
+        - `client`: S3FS connection (default: a new connection, closed
+          afterwards)
+        - `kwargs`: Options of `download_all`
+    """
+    out_path = Path(out_path)
+    out_path.mkdir(parents=True, exist_ok=True)
+    root = out_path.resolve()
+
+    async with connect(client) as client:
+        aws_path = client._strip_protocol(aws_path).rstrip("/")
+        listing = await list_files(client, aws_path)
+
+        synced = read_manifest(out_path, aws_path)
+        current: Dict[str, dict] = {}
+        changed: List[Tuple[str, Path]] = []
+
+        for name, info in listing.items():
+            key = name[len(aws_path) + 1 :]
+            destination = out_path / key
+
+            # Keys are free text, never write outside the download directory
+            if root not in destination.resolve().parents:
+                logger.warning(f"{key} - skipped, outside {out_path}")
+                continue
+
+            current[key] = {
+                "size": info["size"],
+                "etag": info.get("ETag"),
+                "last_modified": as_utc(info["LastModified"]).isoformat(),
+            }
+
+            previous = synced.get(key)
+
+            if (
+                previous is None
+                or previous["etag"] != current[key]["etag"]
+                or previous["size"] != current[key]["size"]
+                or not destination.is_file()
+            ):
+                changed.append((name, destination))
+
+        downloaded = await download_all(client, changed, **kwargs)
+
+    files = dict(current)
+
+    for (name, _), result in zip(changed, downloaded):
+        if not result.ok:
+            key = name[len(aws_path) + 1 :]
+
+            # Keep the old record, so the file is seen as changed next time
+            if key in synced:
+                files[key] = synced[key]
+            else:
+                files.pop(key)
+
+    deleted: List[Path] = []
+
+    for key, record in synced.items():
+        if key in current:
+            continue
+
+        if delete:
+            path = out_path / key
+            path.unlink(missing_ok=True)
+            deleted.append(path)
+            logger.info(f"{key} - deleted")
+        else:
+            files[key] = record
+
+    write_manifest(out_path, aws_path, files)
+
+    return SyncResult(downloaded, len(current) - len(changed), deleted)
+
 
 def download_file(
     aws_path: str,
     out_path: Path,
-    client: S3FileSystem = init_new_client(),
+    client: S3FileSystem = None,
 ):
     """
     Synchronously download an AWS file.
 
     Args:
         - `aws_path`: File path on AWS
+        - `out_path`: Download directory
+        - `client`: S3FS connection (default: the shared connection)
     """
+    client = client or get_client()
     download_destination = f"{out_path}/{os.path.basename(aws_path)}"
 
     client.download(aws_path, download_destination)
@@ -49,28 +529,31 @@ def download_file(
 def download_file_list(
     aws_paths: List[str],
     out_path: Path,
-    client: S3FileSystem = init_new_client(),
+    client: S3FileSystem = None,
+    **kwargs,
 ):
     """
-    Synchronously download a list of AWS files.
+    Synchronously download a list of AWS files, a few at a time (see
+    `download_files`). Returns the downloaded files and the download path
 
     Args:
         - `files`: File paths on AWS
         - `path`: Download path
+        - `client`: S3FS connection (default: the shared connection)
+        - `kwargs`: Options of `download_all`
     """
-    threads: List[Thread] = []
-
-    for index, file in enumerate(aws_paths):
-        thread = Thread(
-            target=download_file, args=(file,), kwargs={"client": client}
-        )
-        threads.append(thread)
-        threads[index].start()
-
-    for thread in threads:
-        thread.join()
+    client = client or get_client()
+
+    results = sync(
+        client.loop,
+        download_files,
+        aws_paths,
+        out_path,
+        client=client,
+        **kwargs,
+    )
 
-    downloaded = list(out_path.iterdir())
+    downloaded = [result.path for result in results if result.ok]
 
     return downloaded, out_path
 
@@ -80,51 +563,65 @@ def download_by_date_modified(
     stop_date: datetime,
     files: List[str],
     out_path: Path,
-    client: S3FileSystem = init_new_client(),
+    client: S3FileSystem = None,
+    **kwargs,
 ):
     """
-    Download files on AWS directory by their modified dates
+    Download files on AWS directory by their modified dates, a few at a
+    time (see `download_modified`). Returns the downloaded files and the
+    download path
 
     Args:
         - `start_date`: Start date for processing
         - `stop_date`: End date for processing
         - `files`: File paths on AWS
+        - `client`: S3FS connection (default: the shared connection)
+        - `kwargs`: Options of `download_all`
     """
-    threads: List[Thread] = []
-
-    def check_modified_date_and_download(aws_path: str):
-        """
-        Check modified date and download if within start and end date
-
-        Args:
-            - `aws_path`: File path on AWS
-        """
-        last_modified: datetime = client.modified(aws_path)
-        with_tz = last_modified.replace(tzinfo=pytz.utc)
-
-        before_stop_date = True
-
-        if stop_date is not None:
-            before_stop_date = last_modified < stop_date
-
-        if with_tz > start_date and before_stop_date:
-            download_destination = f"{out_path}/{os.path.basename(aws_path)}"
-            client.download(aws_path, download_destination)
-
-            logger.info(f"{os.path.basename(aws_path)} - downloaded")
+    client = client or get_client()
+
+    results = sync(
+        client.loop,
+        download_modified,
+        start_date,
+        stop_date,
+        files,
+        out_path,
+        client=client,
+        **kwargs,
+    )
 
-        else:
-            logger.warning(f"{last_modified} - out of range")
+    downloaded = [result.path for result in results if result.ok]
 
-    # Create list of threads to download files within start/stop date
-    for index, file in enumerate(files):
-        thread = Thread(target=check_modified_date_and_download, args=(file,))
-        threads.append(thread)
-        threads[index].start()
+    return downloaded, out_path
 
-    for thread in threads:
-        thread.join()
 
-    downloaded = list(out_path.iterdir())
+def sync_directory(
+    aws_path: str,
+    out_path: Path,
+    delete: bool = False,
+    client: S3FileSystem = None,
+    **kwargs,
+):
+    """
+    Synchronously make a download directory match an AWS directory,
+    downloading only new and changed files (see `sync_files`)
 
-    return downloaded, out_path
+    Args:
+        - `aws_path`: Directory path on AWS
+        - `out_path`: Download directory
+        - `delete`: Remove local files removed from AWS since the last sync
+        - `client`: S3FS connection (default: the shared connection)
+        - `kwargs`: Options of `download_all`
+    """
+    client = client or get_client()
+
+    return sync(
+        client.loop,
+        sync_files,
+        aws_path,
+        out_path,
+        delete=delete,
+        client=client,
+        **kwargs,
+    )
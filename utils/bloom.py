@@ -0,0 +1,59 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    A fixed size Bloom filter of strings. Membership checks can return false
+    positives (at roughly `error_rate` when holding `capacity` items) but
+    never false negatives
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """
+        Args:
+            - `capacity`: Expected number of items
+            - `error_rate`: Target false positive rate at capacity
+        """
+        capacity = max(1, capacity)
+
+        self.size = max(
+            8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        )
+        """Number of bits"""
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        """Number of bit positions set per item"""
+
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        """
+        Get the bit positions of an item using double hashing
+
+        Args:
+            - `item`: The item to hash
+        """
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+
+        return (
+            (first + index * second) % self.size
+            for index in range(self.hashes)
+        )
+
+    def add(self, item: str):
+        """
+        Add an item to the filter
+
+        Args:
+            - `item`: The item to add
+        """
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """
+    A size bounded least-recently-used cache where every entry can carry its
+    own expiry. Not thread safe, use one per event loop
+    """
+
+    def __init__(self, maxsize: int, ttl: float = None):
+        """
+        Args:
+            - `maxsize`: Maximum number of entries (0 disables the cache)
+            - `ttl`: Default entry lifetime in seconds (None never expires)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self.hits = 0
+        """Number of lookups answered from the cache"""
+        self.misses = 0
+        """Number of lookups not found or expired"""
+
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None):
+        """
+        Get an entry and mark it as recently used
+
+        Args:
+            - `key`: Entry key
+            - `default`: Returned when the key is missing or expired
+        """
+        entry = self._data.get(key)
+
+        if entry is not None:
+            value, expires = entry
+
+            if expires is None or expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+
+                return value
+
+            del self._data[key]
+
+        self.misses += 1
+
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        """
+        Add or replace an entry, evicting the least recently used entry when
+        the cache is full
+
+        Args:
+            - `key`: Entry key
+            - `value`: Entry value
+            - `ttl`: Entry lifetime in seconds (defaults to the cache's ttl)
+        """
+        if self.maxsize <= 0:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None):
+        """
+        Remove an entry
+
+        Args:
+            - `key`: Entry key
+        """
+        entry = self._data.pop(key, None)
+
+        return default if entry is None else entry[0]
+
+    def items(self):
+        """List the cached (key, value) pairs, including expired ones"""
+
+        return [(key, value) for key, (value, _) in self._data.items()]
+
+    def clear(self):
+        """Remove every entry and reset the counters"""
+
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
@@ -1,4 +1,4 @@
-from typing import Any, List
+from typing import Any, AsyncIterable, Iterable, List, Union
 
 
 def chunker(list: List[Any], chunk_size: int):
@@ -12,3 +12,35 @@ def chunker(list: List[Any], chunk_size: int):
     return (
         list[pos : pos + chunk_size] for pos in range(0, len(list), chunk_size)
     )
+
+
+async def async_chunker(
+    items: Union[Iterable[Any], AsyncIterable[Any]], chunk_size: int
+):
+    """
+    Iterate over an iterable or async iterable in chunks, without reading
+    more than one chunk ahead
+
+    Args:
+        - `items`: Items to iter over
+        - `chunk_size`: Chunk size
+    """
+    chunk: List[Any] = []
+
+    if not hasattr(items, "__aiter__"):
+        for item in items:
+            chunk.append(item)
+
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    else:
+        async for item in items:
+            chunk.append(item)
+
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+
+    if chunk:
+        yield chunk
@@ -0,0 +1,280 @@
+import os
+import threading
+import time
+from typing import Dict, Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from pymongo import monitoring
+
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+"""
+Whether metrics are written to a directory shared by every worker process,
+so any worker can serve the totals. Must be set before the app is imported
+(see startup.sh)
+"""
+
+FAST_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+)
+"""Histogram buckets in seconds for sub-millisecond operations"""
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to send a complete response, by route template",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests being handled",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+
+HASH_QUEUE_WAIT = Histogram(
+    "password_hash_queue_wait_seconds",
+    "Time password hashing jobs wait for a free hashing process",
+    ["operation"],
+    buckets=FAST_BUCKETS,
+)
+HASH_DURATION = Histogram(
+    "password_hash_duration_seconds",
+    "Time spent hashing or verifying passwords in a hashing process",
+    ["operation"],
+)
+HASH_REJECTED = Counter(
+    "password_hash_rejected_total",
+    "Password hashing jobs rejected because the queue was full",
+)
+
+JWT_VERIFY = Histogram(
+    "jwt_verify_duration_seconds",
+    "Time to verify and parse an access token not in the token cache",
+    buckets=FAST_BUCKETS,
+)
+JWT_CACHE = Counter(
+    "jwt_cache_total", "Access token cache lookups", ["result"]
+)
+
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongodb_command_duration_seconds",
+    "MongoDB command round trip time",
+    ["command", "collection", "status"],
+    buckets=FAST_BUCKETS,
+)
+MONGO_COMMANDS_PER_REQUEST = Histogram(
+    "mongodb_commands_per_request",
+    "MongoDB commands run by an HTTP request, by route template",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 4, 5, 10, 25, 50, 100),
+)
+MONGO_POOL_MAX_SIZE = Gauge(
+    "mongodb_pool_max_size",
+    "Most connections the pool may open to each server",
+    multiprocess_mode="livesum",
+)
+MONGO_POOL_CHECKOUT_WAIT = Histogram(
+    "mongodb_pool_checkout_wait_seconds",
+    "Time waiting to check a connection out of the pool",
+    buckets=FAST_BUCKETS,
+)
+MONGO_POOL_CHECKOUT_FAILED = Counter(
+    "mongodb_pool_checkout_failed_total",
+    "Failed connection checkouts",
+    ["reason"],
+)
+MONGO_POOL_CHECKED_OUT = Gauge(
+    "mongodb_pool_checked_out_connections",
+    "Connections checked out of the pool",
+    multiprocess_mode="livesum",
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "mongodb_pool_connections",
+    "Open pool connections",
+    multiprocess_mode="livesum",
+)
+
+
+def command_collection(event: monitoring.CommandStartedEvent) -> str:
+    """
+    Get the collection a MongoDB command runs on, or "" for commands that
+    don't run on a collection
+
+    Args:
+        - `event`: The command's started event
+    """
+    collection = event.command.get(event.command_name)
+
+    return collection if isinstance(collection, str) else ""
+
+
+def route_name(scope) -> str:
+    """
+    Get the template of the route that handled a request, which the router
+    adds to the ASGI scope
+
+    Args:
+        - `scope`: The request's ASGI scope
+    """
+    route = scope.get("route")
+
+    return "<unmatched>" if route is None else route.path
+
+
+def render() -> Tuple[bytes, str]:
+    """
+    Get every metric in the Prometheus text format and its content type.
+    With a multiprocess directory the values of every worker are aggregated
+    """
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """
+    Drop the live gauges of a worker that exited. Called by gunicorn
+
+    Args:
+        - `pid`: The worker's process ID
+    """
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+class MetricsMiddleware:
+    """
+    Record the latency of every HTTP request by route template, and the
+    number of requests in flight. Latency includes streaming the body
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        start = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            REQUEST_LATENCY.labels(
+                method, route_name(scope), str(status)
+            ).observe(time.perf_counter() - start)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Record the latency of MongoDB commands by collection"""
+
+    def __init__(self):
+        self.collections: Dict[int, str] = {}
+        """Collection of each running command by request ID"""
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        self.collections[event.request_id] = command_collection(event)
+
+    def observe(self, event, status: str):
+        collection = self.collections.pop(event.request_id, "")
+        MONGO_COMMAND_LATENCY.labels(
+            event.command_name, collection, status
+        ).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self.observe(event, "succeeded")
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self.observe(event, "failed")
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Record connection pool size and checkout times"""
+
+    def __init__(self):
+        self.checkout = threading.local()
+        """
+        When this thread started checking out a connection. Checkout events
+        fire on the thread running the operation
+        """
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec()
+
+    def connection_check_out_started(self, event):
+        self.checkout.started = time.perf_counter()
+
+    def waited(self) -> float:
+        started = getattr(self.checkout, "started", None)
+        self.checkout.started = None
+
+        return 0.0 if started is None else time.perf_counter() - started
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILED.labels(event.reason).inc()
+        MONGO_POOL_CHECKOUT_WAIT.observe(self.waited())
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CHECKED_OUT.inc()
+        MONGO_POOL_CHECKOUT_WAIT.observe(self.waited())
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec()
+
+
+command_metrics = CommandMetrics()
+pool_metrics = PoolMetrics()
@@ -1,30 +1,126 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Set, Tuple
 import pymongo
+from pymongo import monitoring
 from pymongo.database import Database
 import motor.motor_asyncio as async_client
 import beanie
 
+import config
+import utils.metrics as metrics
+from utils.query_log import command_log
+from models.security import RevokedToken
 from models.user import User
 
-models = [User]
+settings = config.get_settings()
+logger = logging.getLogger("uvicorn.error")
 
+models = [RevokedToken, User]
 
-class MongoManager:
-    client: pymongo.MongoClient = None
-    """The connected pymongo client"""
 
+class PoolSize(monitoring.ConnectionPoolListener):
+    """
+    Track the connections ready in each server's pool. Pool events fire on
+    pymongo's threads, including the one filling pools to `minPoolSize`
+    """
+
+    def __init__(self):
+        self.pools: Set[Tuple[str, int]] = set()
+        """Addresses of the pools ready to be used"""
+
+        self.connections: Dict[Tuple[str, int], Set[int]] = {}
+        """IDs of the ready connections, by server address"""
+
+    def smallest(self) -> int:
+        """Connections in the smallest ready pool, 0 if none is ready"""
+
+        pools = list(self.pools)
+
+        return min(
+            (len(self.connections.get(address, ())) for address in pools),
+            default=0,
+        )
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        self.pools.add(event.address)
+
+    def pool_cleared(self, event):
+        self.pools.discard(event.address)
+
+    def pool_closed(self, event):
+        self.pools.discard(event.address)
+        self.connections.pop(event.address, None)
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        self.connections.setdefault(event.address, set()).add(
+            event.connection_id
+        )
+
+    def connection_closed(self, event):
+        self.connections.get(event.address, set()).discard(event.connection_id)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+class MongoManager:
     async_client: pymongo.MongoClient = None
     """The connected async pymongo client"""
 
-    db: Database = None
-    """The default pymongo database"""
-
     async_db: Database = None
     """The default pymongo database"""
 
+    sync_client: pymongo.MongoClient = None
+    """The pymongo client, None until `client` is first used"""
+
+    pool_size: PoolSize = None
+    """Connections ready in the async client's pools"""
+
+    def options(self, *listeners) -> dict:
+        """
+        Connection pool and timeout options of both clients
+
+        Args:
+            - `listeners`: Event listeners of this client only
+        """
+
+        return dict(
+            maxPoolSize=settings.DB_MAX_POOL_SIZE,
+            minPoolSize=settings.DB_MIN_POOL_SIZE,
+            maxConnecting=settings.DB_MAX_CONNECTING,
+            maxIdleTimeMS=settings.DB_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=settings.DB_WAIT_QUEUE_TIMEOUT_MS,
+            connectTimeoutMS=settings.DB_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=settings.DB_SERVER_SELECTION_TIMEOUT_MS,
+            event_listeners=[
+                metrics.command_metrics,
+                metrics.pool_metrics,
+                command_log,
+                *listeners,
+            ],
+        )
+
     async def connect(self, db_url: str, db_name: str):
         """
-        Initialize MongoDB connections. Creates async and sync MongoDB
-        clients/DBs
+        Initialize the async MongoDB connection. The sync client is only
+        created if it is used (see `client`)
 
         Args:
             - `db_url`: MongoDB URI
@@ -33,14 +129,56 @@ class MongoManager:
         self.uri = db_url
         self.db_name = db_name
 
+        self.pool_size = PoolSize()
         self.async_client = async_client.AsyncIOMotorClient(
-            db_url, maxPoolSize=10, minPoolSize=10
+            db_url, **self.options(self.pool_size)
         )
+        self.async_db = self.async_client[db_name]
 
-        self.client = pymongo.MongoClient(db_url)
-        self.db = self.client[db_name]
+        metrics.MONGO_POOL_MAX_SIZE.set(settings.DB_MAX_POOL_SIZE)
 
-        self.async_db = self.async_client[db_name]
+    @property
+    def client(self) -> pymongo.MongoClient:
+        """The pymongo client, created on first use"""
+
+        if self.sync_client is None:
+            # Rarely used, so no connections are kept open
+            options = {**self.options(), "minPoolSize": 0}
+            self.sync_client = pymongo.MongoClient(self.uri, **options)
+
+        return self.sync_client
+
+    @property
+    def db(self) -> Database:
+        """The default pymongo database"""
+
+        return self.client[self.db_name]
+
+    async def warm(self, connections: int, timeout: float):
+        """
+        Wait for pool connections to be opened before serving requests, so
+        the first requests don't wait for connections to be made. A ping
+        finds a server, then pymongo opens `minPoolSize` connections in the
+        background, `maxConnecting` at a time. Waits until every ready pool
+        has `connections`, or logs a warning and carries on after `timeout`
+
+        Args:
+            - `connections`: Connections each pool should have
+            - `timeout`: Longest wait in seconds
+        """
+        deadline = time.monotonic() + timeout
+
+        await self.async_client.admin.command("ping")
+
+        while self.pool_size.smallest() < connections:
+            if time.monotonic() > deadline:
+                logger.warning(
+                    f"Database pool: {self.pool_size.smallest()} of "
+                    f"{connections} connections open after {timeout}s"
+                )
+                return
+
+            await asyncio.sleep(0.05)
 
     async def init_beanie(self, db_name: str):
         """
@@ -54,10 +192,14 @@ class MongoManager:
         )
 
     async def close(self):
-        """Close database connection"""
+        """Close database connections"""
 
         self.async_client.close()
 
+        if self.sync_client is not None:
+            self.sync_client.close()
+            self.sync_client = None
+
 
 manager = MongoManager()
 
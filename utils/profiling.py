@@ -0,0 +1,230 @@
+import cProfile
+import marshal
+import pstats
+import re
+import sys
+import threading
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+from fastapi import HTTPException, Request, status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
+
+import config
+import auth.jwt
+import auth.security
+
+settings = config.get_settings()
+
+PROFILE_HEADER = b"x-profile"
+"""Request header asking for a profile: `collapsed` or `pstats`"""
+
+PROFILE_ID_HEADER = "X-Profile-Id"
+"""Response header with the ID to download the profile with"""
+
+FORMATS = {"collapsed": ".collapsed.txt", "pstats": ".pstats"}
+"""File suffix of each profile format"""
+
+
+class StackSampler:
+    """
+    Sample the stack of a thread at an interval and count the stacks as
+    collapsed stacks (`outer;inner count` lines) for flame graph tools
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+
+            while frame is not None:
+                code = frame.f_code
+                name, line = code.co_name, code.co_firstlineno
+                stack.append(f"{name} ({code.co_filename}:{line})")
+                frame = frame.f_back
+
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def report(self) -> bytes:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.items()
+        ).encode()
+
+
+def profile_path(id: str, format: str) -> Path:
+    """
+    Get where a profile is stored
+
+    Args:
+        - `id`: The profile's ID
+        - `format`: `collapsed` or `pstats`
+    """
+    return Path(settings.PROFILE_DIR) / f"{id}{FORMATS[format]}"
+
+
+def find_profile(id: str) -> Optional[Path]:
+    """
+    Get a stored profile, or None if there is no such profile
+
+    Args:
+        - `id`: The profile's ID
+    """
+    if not re.fullmatch(r"[0-9a-f]{32}", id):
+        return None
+
+    for format in FORMATS:
+        path = profile_path(id, format)
+
+        if path.is_file():
+            return path
+
+    return None
+
+
+def save_profile(id: str, format: str, report: bytes):
+    """
+    Store a profile where every worker can serve it, keeping only the
+    newest `PROFILE_KEEP` profiles
+
+    Args:
+        - `id`: The profile's ID
+        - `format`: `collapsed` or `pstats`
+        - `report`: The profile
+    """
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_path(id, format).write_bytes(report)
+
+    # Other workers prune the same directory, files can vanish at any time
+    profiles = []
+
+    for path in directory.iterdir():
+        try:
+            profiles.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            pass
+
+    profiles.sort()
+
+    for _, path in profiles[: -settings.PROFILE_KEEP]:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+async def authorize(scope):
+    """
+    Check that a request is from an active superuser, the same way the
+    routes behind `get_current_active_superuser` do. Raises `HTTPException`
+
+    Args:
+        - `scope`: The request's ASGI scope
+    """
+    token = await auth.security.oauth2_scheme(Request(scope))
+    user = await auth.jwt.get_current_user_from_token(token)
+    user = await auth.jwt.get_active_user(user)
+
+    await auth.jwt.get_current_active_superuser(user)
+
+
+class ProfilingMiddleware:
+    """
+    Profile a request from a superuser that sends an `X-Profile` header.
+    `collapsed` samples the event loop's stack every `PROFILE_SAMPLE_MS`,
+    `pstats` runs the deterministic profiler. Both see everything the event
+    loop does while the request runs, including other requests. The profile
+    is stored for download from `/profiles/{id}`, its ID is sent in the
+    `X-Profile-Id` header. Requests without the header are passed straight
+    through
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.busy = False
+        """Whether a request is being profiled, only one can be at once"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        format = None
+
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                format = value.decode("latin-1").strip().lower()
+                break
+
+        if format is None:
+            return await self.app(scope, receive, send)
+
+        try:
+            if format not in FORMATS:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"X-Profile must be one of {', '.join(FORMATS)}",
+                )
+
+            await authorize(scope)
+
+            if self.busy:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Another request is being profiled",
+                )
+        except HTTPException as error:
+            response = JSONResponse(
+                {"detail": error.detail},
+                status_code=error.status_code,
+                headers=error.headers,
+            )
+            return await response(scope, receive, send)
+
+        id = uuid.uuid4().hex
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(PROFILE_ID_HEADER, id)
+
+            await send(message)
+
+        self.busy = True
+
+        if format == "pstats":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler(
+                threading.get_ident(), settings.PROFILE_SAMPLE_MS / 1000
+            )
+            profiler.start()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if format == "pstats":
+                profiler.disable()
+                report = marshal.dumps(pstats.Stats(profiler).stats)
+            else:
+                profiler.stop()
+                report = profiler.report()
+
+            self.busy = False
+            save_profile(id, format, report)
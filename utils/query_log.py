@@ -0,0 +1,182 @@
+import logging
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from pymongo import monitoring
+from starlette.datastructures import MutableHeaders
+
+import config
+import utils.metrics as metrics
+
+settings = config.get_settings()
+
+logger = logging.getLogger("uvicorn.error")
+
+QUERY_COUNT_HEADER = "X-DB-Query-Count"
+"""Response header with the number of MongoDB commands a request ran"""
+
+
+class Command(NamedTuple):
+    """A MongoDB command run by a request"""
+
+    name: str
+    collection: str
+    duration_ms: float
+    filter: str
+    """The command's filter as text, to spot repeated queries"""
+
+
+class RequestQueries:
+    """The MongoDB commands run while handling one HTTP request"""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        """The request's path, replaced by its route template once routed"""
+        self.commands: List[Command] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.commands)
+
+    def repeated(self) -> Dict[Tuple[str, str, str], int]:
+        """Get the commands run more than once with the same filter"""
+
+        counts = Counter(
+            (command.name, command.collection, command.filter)
+            for command in self.commands
+            if command.filter
+        )
+
+        return {key: count for key, count in counts.items() if count > 1}
+
+
+current_request: ContextVar[Optional[RequestQueries]] = ContextVar(
+    "current_request", default=None
+)
+"""
+The request being handled. Motor runs commands in threads with a copy of
+the caller's context, so command events can find their request
+"""
+
+
+def filter_shape(value) -> str:
+    """
+    Describe a filter by its fields and operators only, so logs don't
+    contain user data
+
+    Args:
+        - `value`: A MongoDB filter or value
+    """
+    if isinstance(value, dict):
+        fields = ", ".join(
+            f"{key}: {filter_shape(item)}" for key, item in value.items()
+        )
+
+        return f"{{{fields}}}"
+
+    if isinstance(value, list):
+        return f"[{', '.join(filter_shape(item) for item in value[:1])}]"
+
+    return "?"
+
+
+class CommandLog(monitoring.CommandListener):
+    """
+    Record the MongoDB commands of each request and log commands slower
+    than `SLOW_QUERY_MS`
+    """
+
+    def __init__(self):
+        self.started_commands: Dict[int, Tuple[str, dict, object]] = {}
+        """Collection, command and request of running commands by ID"""
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        self.started_commands[event.request_id] = (
+            metrics.command_collection(event),
+            event.command.get("filter", event.command.get("query")),
+            current_request.get(),
+        )
+
+    def finished(self, event, failed: bool):
+        collection, filter, request = self.started_commands.pop(
+            event.request_id, ("", None, None)
+        )
+        duration_ms = event.duration_micros / 1000
+
+        if request is not None:
+            request.commands.append(
+                Command(
+                    event.command_name,
+                    collection,
+                    duration_ms,
+                    "" if filter is None else repr(filter),
+                )
+            )
+
+        if duration_ms >= settings.SLOW_QUERY_MS:
+            logger.warning(
+                "Slow MongoDB command: %s %s %s took %.1fms%s%s",
+                event.command_name,
+                collection,
+                filter_shape(filter),
+                duration_ms,
+                " (failed)" if failed else "",
+                "" if request is None else f" in {request.path}",
+            )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self.finished(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self.finished(event, failed=True)
+
+
+command_log = CommandLog()
+
+
+class QueryCountMiddleware:
+    """
+    Track the MongoDB commands of each request. The count is sent in the
+    `X-DB-Query-Count` header and recorded per route, and repeated queries
+    are logged
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request = RequestQueries(scope["method"], scope["path"])
+        token = current_request.set(request)
+
+        async def send_wrapper(message):
+            # Commands run while streaming the body come after the header
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append(QUERY_COUNT_HEADER, str(request.count))
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            request.path = metrics.route_name(scope)
+
+            metrics.MONGO_COMMANDS_PER_REQUEST.labels(
+                request.method, request.path
+            ).observe(request.count)
+
+            for (name, collection, _), count in request.repeated().items():
+                logger.warning(
+                    "Repeated MongoDB command: %s %s %s %s ran %d times "
+                    "with the same filter",
+                    request.method,
+                    request.path,
+                    name,
+                    collection,
+                    count,
+                )
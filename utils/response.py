@@ -0,0 +1,39 @@
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+
+def encode_default(value: Any):
+    """
+    Encode the values orjson doesn't support natively. Models are encoded
+    by field alias without re-validating or deep copying them
+
+    Args:
+        - `value`: The value to encode
+    """
+    if isinstance(value, BaseModel):
+        return {
+            field.alias: getattr(value, name)
+            for name, field in value.__fields__.items()
+        }
+
+    if isinstance(value, ObjectId):
+        return str(value)
+
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(Response):
+    """
+    A JSON response encoded with orjson. Returning it from a route skips the
+    route's `response_model` validation, so only return content that is
+    already shaped like the response model
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=encode_default)
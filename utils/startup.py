@@ -0,0 +1,64 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class StartupReport:
+    """
+    Time how long a worker takes to import the app and run each startup
+    phase, and whether it has finished starting and can take requests
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        """When this module was imported, the first thing the app imports"""
+
+        self.phases: Dict[str, float] = {}
+        """Seconds taken by each phase, in the order they ran"""
+
+        self.ready = False
+        """Whether every startup phase has run"""
+
+    def mark(self, name: str):
+        """
+        Record a phase that ran since the worker started
+
+        Args:
+            - `name`: The phase
+        """
+        self.phases[name] = time.perf_counter() - self.started
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time a phase
+
+        Args:
+            - `name`: The phase
+        """
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    def finish(self):
+        """Mark the worker ready and log how long each phase took"""
+
+        self.ready = True
+
+        logger.info(
+            "Startup: "
+            + ", ".join(
+                f"{name} {seconds * 1000:.0f}ms"
+                for name, seconds in self.phases.items()
+            )
+            + f", total {(time.perf_counter() - self.started) * 1000:.0f}ms"
+        )
+
+
+report = StartupReport()
@@ -0,0 +1,131 @@
+import csv
+import io
+import json
+import zlib
+from typing import Any, AsyncIterable, Dict, List
+
+CHUNK_SIZE = 64 * 1024
+"""Bytes buffered before a chunk is sent"""
+
+
+async def ndjson_chunks(rows: AsyncIterable[Dict[str, Any]]):
+    """
+    Encode rows as newline delimited JSON chunks. The first row is sent on
+    its own so the client gets a response straight away
+
+    Args:
+        - `rows`: Rows to encode
+    """
+    buffer: List[str] = []
+    size = 0
+    first = True
+
+    async for row in rows:
+        line = json.dumps(row) + "\n"
+        buffer.append(line)
+        size += len(line)
+
+        if first or size >= CHUNK_SIZE:
+            yield "".join(buffer).encode()
+            buffer.clear()
+            size = 0
+            first = False
+
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+async def csv_chunks(rows: AsyncIterable[Dict[str, Any]], fields: List[str]):
+    """
+    Encode rows as CSV chunks, starting with a header row
+
+    Args:
+        - `rows`: Rows to encode
+        - `fields`: Column names, in order
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+
+    yield buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+
+    async for row in rows:
+        writer.writerow(row)
+
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def gzip_chunks(chunks: AsyncIterable[bytes]):
+    """
+    Gzip a stream of chunks. Every chunk is flushed so the client can start
+    decompressing before the stream ends
+
+    Args:
+        - `chunks`: Chunks to compress
+    """
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+
+    async for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    yield compressor.flush()
+
+
+def parse_ndjson_line(line: bytes) -> Any:
+    """
+    Parse a line of newline delimited JSON. A line that isn't valid JSON is
+    returned as a string so the caller can report it
+
+    Args:
+        - `line`: The line
+    """
+    try:
+        return json.loads(line)
+    except ValueError:
+        return line.decode(errors="replace")
+
+
+async def parse_ndjson(chunks: AsyncIterable[bytes], max_line: int):
+    """
+    Parse newline delimited JSON as it arrives, skipping blank lines. A line
+    longer than `max_line` is dropped without being held in memory, and
+    reported as a string like any other invalid line
+
+    Args:
+        - `chunks`: The newline delimited JSON, in chunks split anywhere
+        - `max_line`: Most bytes in a line
+    """
+    too_long = f"Line longer than {max_line} bytes"
+    buffer = b""
+    skipping = False
+
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+
+        for line in lines:
+            if skipping:
+                # The end of a line already reported
+                skipping = False
+            elif len(line) > max_line:
+                yield too_long
+            elif line.strip():
+                yield parse_ndjson_line(line)
+
+        if len(buffer) > max_line:
+            if not skipping:
+                yield too_long
+
+            buffer = b""
+            skipping = True
+
+    if buffer.strip() and not skipping:
+        yield parse_ndjson_line(buffer)